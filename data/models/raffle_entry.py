@@ -7,3 +7,32 @@ class RaffleEntry:
     full_name: str
     created_at: datetime
     country: str
+
+
+# The raffle entries are assigned one of these countries at random
+countries = [
+    'Albania',
+    'Austria',
+    'Belgium',
+    'Croatia',
+    'Czech Republic',
+    'Denmark',
+    'England',
+    'France',
+    'Georgia',
+    'Germany',
+    'Hungary',
+    'Italy',
+    'Netherlands',
+    'Poland',
+    'Portgal',
+    'Romania',
+    'Scotland',
+    'Serbia',
+    'Slovakia',
+    'Slovenia',
+    'Spain',
+    'Switzerland',
+    'Turkey',
+    'Ukraine',
+]
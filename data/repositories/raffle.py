@@ -6,8 +6,17 @@ class RaffleRepository:
     def get_by_user(self, user: User) -> list[RaffleEntry]:
         pass
 
+    def count_by_user(self, user: User) -> int:
+        pass
+
     def list_by_user(self) -> dict[str, list[RaffleEntry]]:
         pass
 
     def create(self, user: User) -> RaffleEntry:
         pass
+
+    def add(self, entry: RaffleEntry) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
@@ -5,6 +5,10 @@ from data.models.task import Task
 
 
 class TaskRepository(ABC):
+    @abstractmethod
+    def get_all_tasks(self) -> list[Task]:
+        pass
+
     @abstractmethod
     def get_tasks_between(self, start: datetime, end: datetime) -> list[Task]:
         pass
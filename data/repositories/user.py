@@ -28,3 +28,6 @@ class UserRepository:
 
     def save_all(self, users: list[User]) -> None:
         pass
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,57 @@
+import threading
+from collections import Counter
+
+
+# Thread-safe counters and timings for the integrations,
+# so we can measure how many calls we make to external services and how long they take
+class Metrics:
+    # The upper bounds of the latency histogram buckets, in seconds
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Counter[str] = Counter()
+        self._timings: dict[str, dict[str, float]] = {}
+        self._histograms: dict[str, list[int]] = {}
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters[name]
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+            timing['last'] = seconds
+
+            histogram = self._histograms.setdefault(name, [0] * len(Metrics.BUCKETS))
+            histogram[next(i for i, bound in enumerate(Metrics.BUCKETS) if seconds <= bound)] += 1
+
+    def timing(self, name: str) -> dict[str, float]:
+        with self._lock:
+            return dict(self._timings.get(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}))
+
+    def histogram(self, name: str) -> dict[float, int]:
+        # How many observations fell into each bucket, keyed by the upper bound of the bucket
+        with self._lock:
+            return dict(zip(Metrics.BUCKETS, self._histograms.get(name, [0] * len(Metrics.BUCKETS))))
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def report(self) -> list[str]:
+        # One line for every counter and timing, sorted by name, so related metrics end up next to each other
+        with self._lock:
+            lines = [(name, f"{name}: {count}") for name, count in self._counters.items()]
+            lines += [
+                (name, f"{name}: {timing['count']} calls, {timing['total'] / timing['count'] * 1000:.0f} ms on average, {timing['max'] * 1000:.0f} ms at most")
+                for name, timing in self._timings.items() if timing['count']
+            ]
+        return [line for _, line in sorted(lines)]
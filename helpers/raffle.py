@@ -4,11 +4,11 @@ from data.repositories.raffle import RaffleRepository
 
 from helpers.points import Points
 
-from integrations.loyverse.api import LoyverseApi
+from integrations.loyverse.async_api import AsyncLoyverseApi
 
 
 class Raffle:
-    def __init__(self, loy: LoyverseApi, entries: RaffleRepository, title: str, ticket_price: Points, max_tickets: int = 3, is_active: bool = True):
+    def __init__(self, loy: AsyncLoyverseApi, entries: RaffleRepository, title: str, ticket_price: Points, max_tickets: int = 3, is_active: bool = True):
         self.loy = loy
         self.title = title
         self.ticket_price = ticket_price
@@ -22,15 +22,15 @@ class Raffle:
     def stop(self) -> None:
         self.is_active = False
 
-    def buy_ticket(self, user: User) -> None:
-        self.loy.remove_points(user, self.ticket_price)
+    async def buy_ticket(self, user: User) -> None:
+        await self.loy.remove_points(user, self.ticket_price)
         self.entries.create(user)
 
     def get_entries(self, user: User) -> list[RaffleEntry]:
         return self.entries.get_by_user(user)
 
     def has_entries(self, user: User) -> bool:
-        return len(self.get_entries(user)) > 0
+        return self.entries.count_by_user(user) > 0
 
     def can_enter(self, user: User) -> bool:
-        return self.max_tickets > 0 and len(self.get_entries(user)) < self.max_tickets
+        return self.max_tickets > 0 and self.entries.count_by_user(user) < self.max_tickets
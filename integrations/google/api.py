@@ -1,17 +1,113 @@
 import json
+import logging
+import threading
+from typing import Callable, Optional, TypeVar
+
 import gspread
+from google.auth.exceptions import GoogleAuthError
+
+from helpers.metrics import Metrics
+
+from integrations.google.request_scheduler import GoogleRequestScheduler, Priority
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
 
 
 class GoogleApi:
-    def __init__(self, credentials: str):
+    def __init__(self, credentials: str, requests_per_minute: int = 60):
         try:
             self.credentials = json.loads(credentials)
         except TypeError as e:
             raise TypeError('Could not parse the Google API credentials') from e
 
-    def get_spreadsheet(self, key: str) -> gspread.Spreadsheet:
+        # The client keeps its own authorized session, which refreshes the access token by itself when it expires,
+        # so it can be reused for the whole lifetime of the bot, together with the spreadsheets we have opened
+        self._lock = threading.Lock()
+        self._client: Optional[gspread.Client] = None
+        self._spreadsheets: dict[str, gspread.Spreadsheet] = {}
+        self._worksheets: dict[tuple[str, str], gspread.Worksheet] = {}
+
+        self.metrics = Metrics()
+        self.scheduler = GoogleRequestScheduler(requests_per_minute, metrics=self.metrics)
+
+    def execute(self, call: Callable[[], T], priority: Priority = Priority.INTERACTIVE, idempotent: bool = True) -> T:
+        # All the calls that reach Google must go through the scheduler
+        return self.scheduler.execute(call, priority, idempotent)
+
+    def get_spreadsheet(self, key: str, priority: Priority = Priority.INTERACTIVE) -> gspread.Spreadsheet:
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(key)
+        if spreadsheet:
+            return spreadsheet
+
         try:
-            gc = gspread.service_account_from_dict(self.credentials)
-            return gc.open_by_key(key)
+            spreadsheet = self.execute(lambda: self._get_client().open_by_key(key), priority)
         except Exception as e:
             raise Exception(f'Could not open the spreadsheet {key}') from e
+
+        with self._lock:
+            return self._spreadsheets.setdefault(key, spreadsheet)
+
+    def get_worksheet(self, key: str, name: str, priority: Priority = Priority.INTERACTIVE) -> gspread.Worksheet:
+        # Looking up a worksheet by name downloads the spreadsheet metadata, so we only do it once
+        with self._lock:
+            worksheet = self._worksheets.get((key, name))
+        if worksheet:
+            return worksheet
+
+        spreadsheet = self.get_spreadsheet(key, priority)
+        worksheet = self.execute(lambda: spreadsheet.worksheet(name), priority)
+
+        with self._lock:
+            return self._worksheets.setdefault((key, name), worksheet)
+
+    def get_modified_time(self, key: str, priority: Priority = Priority.INTERACTIVE) -> str:
+        # This only asks Drive for the file metadata, which is much cheaper than downloading any values
+        spreadsheet = self.get_spreadsheet(key, priority)
+        self.execute(lambda: spreadsheet.refresh_lastUpdateTime(), priority)
+        return spreadsheet.lastUpdateTime
+
+    def invalidate(self, key: str = None) -> None:
+        # Forget the spreadsheet handles, so they are opened again on the next call
+        with self._lock:
+            if key:
+                self._spreadsheets.pop(key, None)
+                self._worksheets = {k: v for k, v in self._worksheets.items() if k[0] != key}
+            else:
+                self._spreadsheets = {}
+                self._worksheets = {}
+
+    def reset(self) -> None:
+        # Forget the client as well, so the credentials are created again on the next call
+        with self._lock:
+            self._client = None
+            self._spreadsheets = {}
+            self._worksheets = {}
+
+    def recover(self, error: Exception) -> None:
+        # The credentials are only created again when Google rejects them
+        if GoogleApi._is_auth_error(error):
+            logger.warning('Google rejected our credentials, they will be created again')
+            self.reset()
+        else:
+            self.invalidate()
+
+    def _get_client(self) -> gspread.Client:
+        with self._lock:
+            if not self._client:
+                logger.info('Authenticating with the Google API')
+                self._client = gspread.service_account_from_dict(self.credentials)
+            return self._client
+
+    @staticmethod
+    def _is_auth_error(error: Optional[BaseException]) -> bool:
+        # The actual error may be wrapped in other exceptions
+        while error:
+            if isinstance(error, GoogleAuthError):
+                return True
+            if isinstance(error, gspread.exceptions.APIError) and error.response.status_code in (401, 403):
+                return True
+            error = error.__cause__
+        return False
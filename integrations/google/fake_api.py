@@ -0,0 +1,224 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from gspread.exceptions import APIError
+from gspread.utils import Dimension, a1_range_to_grid_range, fill_gaps
+
+from integrations.google.api import GoogleApi
+
+
+# An in-memory stand-in for the Google API, so the data layer can run without the network
+# It behaves like the small part of gspread that we actually use, and it can simulate the latency of the
+# real API and its failures, so the caching layers can be benchmarked and load-tested on a laptop
+class FakeGoogleApi(GoogleApi):
+    def __init__(self, spreadsheets: dict[str, dict[str, list[list[str]]]] = None, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, failure_status: int = 503, seed: int = None, requests_per_minute: int = 60):
+        super().__init__('{}', requests_per_minute=requests_per_minute)
+        self.client = FakeClient(spreadsheets or {}, latency, jitter, failure_rate, failure_status, seed)
+
+    @staticmethod
+    def from_snapshot(path: str, key: str, **kwargs) -> 'FakeGoogleApi':
+        # Start from the real data, as saved by GoogleSheetDatabase
+        with open(path, 'r', encoding='utf-8') as file:
+            snapshot = json.load(file)
+        return FakeGoogleApi({key: snapshot['values']}, **kwargs)
+
+    def _get_client(self) -> 'FakeClient':
+        return self.client
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.text = f'Simulated error {status_code}'
+
+    def json(self) -> dict:
+        return {'error': {'code': self.status_code, 'message': self.text, 'status': 'SIMULATED'}}
+
+
+class FakeClient:
+    def __init__(self, spreadsheets: dict[str, dict[str, list[list[str]]]], latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, failure_status: int = 503, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.calls: Counter[str] = Counter()
+
+        self._random = random.Random(seed)
+        self._failures: list[int] = []
+        self._lock = threading.Lock()
+
+        self.spreadsheets = {key: FakeSpreadsheet(self, key, sheets) for key, sheets in spreadsheets.items()}
+
+    def fail_next(self, count: int = 1, status_code: int = None) -> None:
+        # The next calls fail for sure, regardless of the failure rate
+        with self._lock:
+            self._failures += [status_code or self.failure_status] * count
+
+    def simulate(self, operation: str) -> None:
+        # Every call costs a round trip, and it may fail just like the real thing
+        with self._lock:
+            self.calls[operation] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if self._failures:
+                failure = self._failures.pop(0)
+            elif self.failure_rate and self._random.random() < self.failure_rate:
+                failure = self.failure_status
+            else:
+                failure = None
+
+        if delay:
+            time.sleep(delay)
+        if failure:
+            raise APIError(FakeResponse(failure))
+
+    def open_by_key(self, key: str) -> 'FakeSpreadsheet':
+        self.simulate('open_by_key')
+        if key not in self.spreadsheets:
+            raise KeyError(f'Spreadsheet {key} not found')
+        return self.spreadsheets[key]
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: FakeClient, key: str, sheets: dict[str, list[list[str]]]):
+        self.client = client
+        self.id = key
+        self.lock = threading.RLock()
+        self.worksheets = {title: FakeWorksheet(self, title, values) for title, values in sheets.items()}
+
+        self._modified_time = datetime.now(timezone.utc)
+        self._properties = {'modifiedTime': FakeSpreadsheet._format_time(self._modified_time)}
+
+    @property
+    def lastUpdateTime(self) -> str:
+        return self._properties['modifiedTime']
+
+    def refresh_lastUpdateTime(self) -> None:
+        self.client.simulate('refresh_lastUpdateTime')
+        with self.lock:
+            self._properties['modifiedTime'] = FakeSpreadsheet._format_time(self._modified_time)
+
+    def worksheet(self, title: str) -> 'FakeWorksheet':
+        self.client.simulate('worksheet')
+        if title not in self.worksheets:
+            raise KeyError(f'Worksheet {title} not found')
+        return self.worksheets[title]
+
+    def values_batch_get(self, ranges: list[str], params: dict = None) -> dict:
+        self.client.simulate('values_batch_get')
+        value_ranges = []
+        with self.lock:
+            for range_name in ranges:
+                title, cells = FakeSpreadsheet._split_range(range_name)
+                value_ranges.append({'range': range_name, 'values': self.worksheets[title].read(cells or '')})
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+    def touch(self) -> None:
+        # Every change moves the modified time forward, even when it happens within the same microsecond
+        with self.lock:
+            self._modified_time = max(datetime.now(timezone.utc), self._modified_time + timedelta(microseconds=1))
+
+    @staticmethod
+    def _split_range(range_name: str) -> tuple[str, Optional[str]]:
+        title, _, cells = range_name.rpartition('!') if '!' in range_name else (range_name, '', None)
+        return title.strip("'"), cells
+
+    @staticmethod
+    def _format_time(value: datetime) -> str:
+        return value.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: FakeSpreadsheet, title: str, values: list[list[str]]):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.values = [[str(value) for value in row] for row in values]
+
+    def get_values(self, range_name: str = None, major_dimension: str = None, **kwargs) -> list[list[str]]:
+        self.spreadsheet.client.simulate('get_values')
+        with self.spreadsheet.lock:
+            values = fill_gaps(self.read(range_name or ''))
+        if major_dimension == Dimension.cols:
+            return [list(column) for column in zip(*values)]
+        return values
+
+    def batch_get(self, ranges: list[str], **kwargs) -> list[list[list[str]]]:
+        self.spreadsheet.client.simulate('batch_get')
+        with self.spreadsheet.lock:
+            return [self.read(range_name) for range_name in ranges]
+
+    def batch_update(self, data: list[dict], **kwargs) -> dict:
+        self.spreadsheet.client.simulate('batch_update')
+        with self.spreadsheet.lock:
+            for update in data:
+                grid = a1_range_to_grid_range(update['range'])
+                for i, row in enumerate(update['values']):
+                    for j, value in enumerate(row):
+                        self._write(grid.get('startRowIndex', 0) + i, grid.get('startColumnIndex', 0) + j, value)
+            self.spreadsheet.touch()
+        return {'totalUpdatedCells': sum(len(row) for update in data for row in update['values'])}
+
+    def update_cell(self, row: int, col: int, value) -> dict:
+        self.spreadsheet.client.simulate('update_cell')
+        with self.spreadsheet.lock:
+            self._write(row - 1, col - 1, value)
+            self.spreadsheet.touch()
+        return {'updatedCells': 1}
+
+    def append_row(self, values: list, **kwargs) -> dict:
+        self.spreadsheet.client.simulate('append_row')
+        return self._append([values])
+
+    def append_rows(self, values: list[list], **kwargs) -> dict:
+        self.spreadsheet.client.simulate('append_rows')
+        return self._append(values)
+
+    def set_values(self, values: list[list[str]]) -> None:
+        # Simulates someone editing the sheet by hand, so it doesn't count as a call
+        with self.spreadsheet.lock:
+            self.values = [[str(value) for value in row] for row in values]
+            self.spreadsheet.touch()
+
+    def read(self, range_name: str) -> list[list[str]]:
+        grid = a1_range_to_grid_range(range_name) if range_name else {}
+        rows = self.values[grid.get('startRowIndex', 0):grid.get('endRowIndex')]
+        columns = slice(grid.get('startColumnIndex', 0), grid.get('endColumnIndex'))
+
+        # Just like the real API, empty cells at the end of the rows and empty rows at the end are left out
+        result = [FakeWorksheet._trim(row[columns]) for row in rows]
+        while result and not result[-1]:
+            result.pop()
+        return result
+
+    def _append(self, rows: list[list]) -> dict:
+        with self.spreadsheet.lock:
+            # Just like the real API, the rows go after the last row that has any values
+            while self.values and not any(self.values[-1]):
+                self.values.pop()
+            start = len(self.values) + 1
+            self.values += [['' if value is None else str(value) for value in row] for row in rows]
+            self.spreadsheet.touch()
+        return {'updates': {'updatedRange': f"'{self.title}'!A{start}", 'updatedRows': len(rows)}}
+
+    def _write(self, row: int, col: int, value) -> None:
+        # A missing value leaves the cell unchanged
+        if value is None:
+            return
+
+        while len(self.values) <= row:
+            self.values.append([])
+        cells = self.values[row]
+        while len(cells) <= col:
+            cells.append('')
+        cells[col] = str(value)
+
+    @staticmethod
+    def _trim(row: list[str]) -> list[str]:
+        trimmed = list(row)
+        while trimmed and trimmed[-1] == '':
+            trimmed.pop()
+        return trimmed
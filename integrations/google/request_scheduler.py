@@ -0,0 +1,110 @@
+import logging
+import random
+import threading
+import time
+from enum import IntEnum
+from typing import Callable, TypeVar
+
+import requests
+from gspread.exceptions import APIError
+
+from helpers.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # Someone is waiting for the result, e.g. a write caused by a command
+    BACKGROUND = 1  # Nobody is waiting, e.g. the periodic refresh
+
+
+# Every call to Google goes through here, so we stay within the per-minute quota of the Sheets API
+# The calls are limited with a token bucket, where interactive calls always go first and background calls leave
+# some tokens in reserve for them. Calls that are throttled or fail temporarily are retried with exponential backoff.
+# A call that is not idempotent, like appending rows, may have gone through even though it failed, so it is only
+# retried when Google throttled it, which means that it was turned away without doing anything.
+class GoogleRequestScheduler:
+    RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, requests_per_minute: int = 60, reserve: int = 5, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0, metrics: Metrics = None):
+        self.capacity = requests_per_minute
+        self.rate = requests_per_minute / 60  # Tokens per second
+        self.reserve = min(reserve, requests_per_minute - 1)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = metrics or Metrics()
+
+        self._condition = threading.Condition()
+        self._tokens = float(requests_per_minute)
+        self._updated_at = time.monotonic()
+        self._waiting_interactive = 0
+
+    def execute(self, call: Callable[[], T], priority: Priority = Priority.INTERACTIVE, idempotent: bool = True) -> T:
+        attempt = 0
+        while True:
+            self._acquire(priority)
+            try:
+                self.metrics.increment('google.calls')
+                return call()
+            except Exception as e:
+                if not GoogleRequestScheduler._is_retryable(e, idempotent) or attempt >= self.max_retries:
+                    raise
+
+                if GoogleRequestScheduler._is_throttled(e):
+                    self.metrics.increment('google.throttled')
+
+                attempt += 1
+                self.metrics.increment('google.retries')
+
+                # Exponential backoff with full jitter, so concurrent callers don't retry in lockstep
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                logger.warning(f"Google call failed ({e}), retrying in {delay:.1f} seconds (attempt {attempt} of {self.max_retries})")
+                time.sleep(delay)
+
+    def _acquire(self, priority: Priority) -> None:
+        interactive = priority == Priority.INTERACTIVE
+        reserve = 0 if interactive else self.reserve
+
+        with self._condition:
+            if interactive:
+                self._waiting_interactive += 1
+
+            try:
+                waited = False
+                while True:
+                    self._refill()
+                    # Background calls also give way to any interactive calls that are waiting
+                    if self._tokens >= 1 + reserve and (interactive or not self._waiting_interactive):
+                        self._tokens -= 1
+                        return
+
+                    if not waited:
+                        waited = True
+                        self.metrics.increment('google.queued_calls')
+
+                    missing = max(1 + reserve - self._tokens, 1)
+                    self._condition.wait(missing / self.rate)
+            finally:
+                if interactive:
+                    self._waiting_interactive -= 1
+                    self._condition.notify_all()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    @staticmethod
+    def _is_retryable(error: Exception, idempotent: bool = True) -> bool:
+        if not idempotent:
+            return GoogleRequestScheduler._is_throttled(error)
+        if isinstance(error, APIError):
+            return error.response.status_code in GoogleRequestScheduler.RETRYABLE_STATUS_CODES
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    @staticmethod
+    def _is_throttled(error: Exception) -> bool:
+        return isinstance(error, APIError) and error.response.status_code == 429
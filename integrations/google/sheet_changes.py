@@ -0,0 +1,23 @@
+from dataclasses import dataclass, field
+
+Row = dict[str, str]
+
+
+# The rows that changed in a sheet between two refreshes, identified by the value in their key column
+@dataclass(frozen=True)
+class SheetChanges:
+    added: list[Row] = field(default_factory=list)
+    removed: list[Row] = field(default_factory=list)
+    modified: list[Row] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.modified)
+
+    @staticmethod
+    def between(old: dict[str, Row], new: dict[str, Row]) -> 'SheetChanges':
+        return SheetChanges(
+            added=[row for key, row in new.items() if key not in old],
+            removed=[row for key, row in old.items() if key not in new],
+            modified=[row for key, row in new.items() if key in old and old[key] != row],
+        )
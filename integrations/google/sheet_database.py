@@ -1,29 +1,50 @@
+import asyncio
+import json
 import logging
+import os
 import re
-from typing import Callable
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 from reactivex import Observable, operators as op
 from reactivex.subject import BehaviorSubject, Subject
 
 import gspread
-from gspread.utils import Dimension
+from gspread.utils import Dimension, ValueInputOption, rowcol_to_a1, absolute_range_name, fill_gaps
 
 from integrations.google.api import GoogleApi
+from integrations.google.request_scheduler import Priority
+from integrations.google.sheet_layout import SheetLayout
+from integrations.google.sheet_changes import SheetChanges
 
 logger = logging.getLogger(__name__)
 
 
 class GoogleSheetDatabase:
-    def __init__(self, spreadsheet_key: str, api_credentials: str = None, api: GoogleApi = None):
+    def __init__(self, spreadsheet_key: str, api_credentials: str = None, api: GoogleApi = None, snapshot_path: str = None):
         self.api = api if api else GoogleApi(api_credentials)
         self.spreadsheet_key = spreadsheet_key
-
-        self._spreadsheet = Subject()
+        self.snapshot_path = snapshot_path
+        self.metrics = self.api.metrics
+
+        # The refreshes run one at a time, away from the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='GoogleSheetRefresh')
+
+        # All the registered sheets are downloaded together, in a single batch, so they are a consistent snapshot
+        self._sheet_names: list[str] = []
+        self._values = Subject()
+        self._layouts: dict[str, SheetLayout] = {}
+        self._modified_time: Optional[str] = None
+        self._live = BehaviorSubject(False)
         self._events = self._table_data('Events')
         self._users = self._table_data('Community')
         self._tasks = self._tasks_data('Team Checklist')
         self._raffle = self._table_data('Raffle')
 
-        self.refresh()
+        # Start with the data saved by the previous run, so we don't have to wait for Google
+        # In that case, the live data is loaded later by the refresh job
+        if not self._load_snapshot():
+            self.refresh()
 
     @property
     def events(self) -> Observable:
@@ -33,6 +54,15 @@ class GoogleSheetDatabase:
     def users(self) -> Observable:
         return self._users
 
+    @property
+    def user_changes(self) -> Observable:
+        return self._row_changes(self._users, 'full_name')
+
+    @property
+    def live(self) -> Observable:
+        # Becomes true once the data is known to match the sheet, as opposed to coming from an old snapshot
+        return self._live.pipe(op.distinct_until_changed())
+
     @property
     def tasks(self) -> Observable:
         return self._tasks
@@ -41,109 +71,223 @@ class GoogleSheetDatabase:
     def raffle(self) -> Observable:
         return self._raffle
 
-    def save_users(self, key_name: str, data: dict[str, dict[str,str]]) -> None:
-        self._update_sheet_data('Community', key_name, data)
+    def save_users(self, key_name: str, data: dict[str, dict[str,str]]) -> dict[str, bool]:
+        return self._update_sheet_data('Community', key_name, data)
 
-    def add_raffle_entry(self, data: dict[str, str]) -> None:
-        self._add_sheet_row('Raffle', data)
+    def add_raffle_entries(self, data: list[dict[str, str]]) -> None:
+        self._add_sheet_rows('Raffle', data)
+
+    def load_raffle_entries(self) -> list[dict[str, str]]:
+        # Always straight from the sheet; neither the snapshot nor the last refresh can tell what was written since
+        return self._load_sheet_rows('Raffle')
 
     def check_task(self, task: dict[str,str]) -> None:
         try:
-            # Load the data from Google
-            spreadsheet = self._load_spreadsheet()
-            worksheet = self._load_worksheet(spreadsheet, 'Team Checklist')
-            raw = worksheet.get_values(major_dimension=Dimension.cols)
-
-            keys = ['time', 'name', 'is_done']
-            cols = len(keys)
-
-            weekday = int(task['weekday'])
-            start = weekday * cols
-            filtered_columns = raw[start:(start + cols)]
-            zipped_rows = list(zip(*filtered_columns))
-            keyed_rows = [dict(zip(keys, row)) for row in zipped_rows]
-
-            last_time = ''
-            for i, row in enumerate(keyed_rows):
-                name = row.get('name', '').strip()
-                if not name:
-                    continue
-                time = row.get('time', '').strip() or last_time
-                last_time = time
+            worksheet = self._load_worksheet('Team Checklist')
 
-                if task['name'] == name and task['time'] == time:
-                    worksheet.update_cell(i + 1, start + 2 + 1, task['is_done'])
-                    return
+            # The task remembers its cell from when it was loaded, so we only need to check that it's still there
+            cell = self._check_task_cell(worksheet, task) or self._find_task_cell(worksheet, task)
+            if not cell:
+                logger.warning(f"Could not find the task {task['name']} in the sheet")
+                return
+
+            self.metrics.increment('google.writes')
+            self.api.execute(lambda: worksheet.update_cell(cell[0], cell[1], task['is_done']))
         except Exception as e:
-            logger.exception(e)
+            # Someone is waiting to see the task checked, so they have to find out that it wasn't
+            self._recover(e)
+            raise
 
-    def _add_sheet_row(self, sheet_name: str, data: dict[str,str]):
-        try:
-            # Load the data from Google
-            spreadsheet = self._load_spreadsheet()
-            worksheet = self._load_worksheet(spreadsheet, sheet_name)
-            raw = self._load_values(worksheet)
+    def _check_task_cell(self, worksheet: gspread.Worksheet, task: dict[str,str]) -> Optional[tuple[int, int]]:
+        if not task.get('row_number') or not task.get('column_number'):
+            return None
 
-            header = raw[0]
+        row_number = int(task['row_number'])
+        column_number = int(task['column_number'])
 
-            # Map the header keys to their column numbers - instead of A, B, C we use 0, 1, 2
-            columns = {GoogleSheetDatabase._header_to_key(h): i for i, h in enumerate(header)}
+        # Only read the name of the task, which is in the middle column
+        self.metrics.increment('google.reads')
+        value_ranges = self.api.execute(lambda: worksheet.batch_get([rowcol_to_a1(row_number, column_number + 1)]))
+        name = value_ranges[0][0][0] if value_ranges[0] and value_ranges[0][0] else ''
+        if name.strip() != task['name']:
+            return None
 
-            # Map the data entries to their column numbers
-            updates_by_column = {columns[k]: v for k, v in data.items() if k in columns}
+        return row_number, column_number + 2
+
+    def _find_task_cell(self, worksheet: gspread.Worksheet, task: dict[str,str]) -> Optional[tuple[int, int]]:
+        # Load the data from Google
+        self.metrics.increment('google.reads')
+        raw = self.api.execute(lambda: worksheet.get_values(major_dimension=Dimension.cols))
+
+        keys = ['time', 'name', 'is_done']
+        cols = len(keys)
+
+        weekday = int(task['weekday'])
+        start = weekday * cols
+        filtered_columns = raw[start:(start + cols)]
+        zipped_rows = list(zip(*filtered_columns))
+        keyed_rows = [dict(zip(keys, row)) for row in zipped_rows]
+
+        last_time = ''
+        for i, row in enumerate(keyed_rows):
+            name = row.get('name', '').strip()
+            if not name:
+                continue
+            time = row.get('time', '').strip() or last_time
+            last_time = time
 
-            # We add 1 to the row to account for the headers
-            GoogleSheetDatabase._add_row(worksheet, updates_by_column)
+            if task['name'] == name and task['time'] == time:
+                # Coordinates start at 1
+                return i + 1, start + 2 + 1
+
+        return None
+
+    def _load_sheet_rows(self, sheet_name: str) -> list[dict[str, str]]:
+        try:
+            worksheet = self._load_worksheet(sheet_name)
+            return GoogleSheetDatabase._parse_sheet_data(self._load_values(worksheet))
         except Exception as e:
-            logger.exception(e)
+            self._recover(e)
+            raise
+
+    def _add_sheet_rows(self, sheet_name: str, data: list[dict[str,str]]) -> None:
+        if not data:
+            return
 
-    def _update_sheet_data(self, sheet_name: str, key_name: str, data: dict[str, dict[str,str]]):
         try:
-            # Load the data from Google
-            spreadsheet = self._load_spreadsheet()
-            worksheet = self._load_worksheet(spreadsheet, sheet_name)
-            raw = self._load_values(worksheet)
+            worksheet = self._load_worksheet(sheet_name)
+            layout = self._get_layout(worksheet, sheet_name)
 
-            header = raw[0]
-            rows = raw[1:]
+            # Map the data entries to their column numbers
+            rows_by_column = [{layout.columns[k]: v for k, v in row.items() if k in layout.columns} for row in data]
 
-            # Map the header keys to their column numbers - instead of A, B, C we use 0, 1, 2
-            columns = {GoogleSheetDatabase._header_to_key(h): i for i, h in enumerate(header)}
+            self._add_rows(worksheet, rows_by_column)
+            logger.info(f"Added {len(data)} rows to {sheet_name} with a single write")
+        except Exception as e:
+            # The caller decides whether to try again
+            self._recover(e)
+            raise
 
-            # Index the rows by the value in the key column
-            key_column = columns[key_name]
-            row_number_by_key = {row[key_column]: i for i, row in enumerate(rows)}
+    def _update_sheet_data(self, sheet_name: str, key_name: str, data: dict[str, dict[str,str]]) -> dict[str, bool]:
+        # Every key gets a result, so the caller knows which rows were actually written
+        results = {key: False for key in data.keys()}
+        try:
+            worksheet = self._load_worksheet(sheet_name)
+            layout = self._get_layout(worksheet, sheet_name, key_name, list(data.keys()))
 
+            # Gather all the changed cells from all the rows, so we can write them with a single call
+            cells = []
             for key, update in data.items():
-                row_number = row_number_by_key.get(key, None)
+                row_number = layout.row_number(key_name, key)
                 if row_number is None:
                     continue
 
                 # Map the updates to their column numbers
-                updates_by_column = {columns[k]: v for k, v in update.items() if k in columns}
+                updates_by_column = {layout.columns[k]: v for k, v in update.items() if k in layout.columns}
                 # We add 1 to the row to account for the headers
-                GoogleSheetDatabase._update_row(worksheet, row_number + 1, updates_by_column)
+                cells += GoogleSheetDatabase._row_cells(row_number + 1, updates_by_column)
+                results[key] = True
+
+            if cells:
+                self._update_cells(worksheet, cells)
+
+            logger.info(f"Saved {sum(results.values())} of {len(results)} rows in {sheet_name}, {len(cells)} cells with a single write")
         except Exception as e:
-            logger.exception(e)
+            # The caller decides whether to try again
+            self._recover(e)
+            raise
 
-    @staticmethod
-    def _update_row(worksheet: gspread.Worksheet, row_number: int, updates_by_column: dict[int, str]) -> None:
-        for k, v in updates_by_column.items():
-            worksheet.update_cell(row_number + 1, k + 1, v)  # Coordinates start at 1
+        return results
+
+    def _get_layout(self, worksheet: gspread.Worksheet, sheet_name: str, key_name: str = None, keys: list[str] = None) -> SheetLayout:
+        layout = self._layouts.get(sheet_name)
+        if layout and self._check_layout(worksheet, layout, key_name, keys or []):
+            return layout
+
+        # The sheet has changed since we last downloaded it, so we need to load the whole thing again
+        logger.info(f"The layout of {sheet_name} has changed, reloading the sheet")
+        self.metrics.increment('google.layout_reloads')
+        layout = GoogleSheetDatabase._make_layout(self._load_values(worksheet))
+        self._layouts[sheet_name] = layout
+        return layout
+
+    def _check_layout(self, worksheet: gspread.Worksheet, layout: SheetLayout, key_name: str = None, keys: list[str] = None) -> bool:
+        # We check the header and the key cells of the rows we are about to write, all in a single read
+        ranges = ['1:1']
+        if key_name:
+            if key_name not in layout.columns:
+                return False
+
+            key_column = layout.columns[key_name]
+            row_numbers = [layout.row_number(key_name, key) for key in keys]
+            if None in row_numbers:
+                return False
+
+            # We add 2 to the row to account for the headers and because coordinates start at 1
+            ranges += [rowcol_to_a1(row_number + 2, key_column + 1) for row_number in row_numbers]
+
+        self.metrics.increment('google.reads')
+        value_ranges = self.api.execute(lambda: worksheet.batch_get(ranges))
+
+        header = value_ranges[0][0] if value_ranges[0] else []
+        if not layout.matches_header(header):
+            return False
+
+        found_keys = [value_range[0][0] if value_range and value_range[0] else '' for value_range in value_ranges[1:]]
+        return found_keys == list(keys or [])
 
     @staticmethod
-    def _add_row(worksheet: gspread.Worksheet, data_by_column: dict[int, str]) -> None:
-        worksheet.append_row(list(dict(sorted(data_by_column.items())).values()))
+    def _row_cells(row_number: int, updates_by_column: dict[int, str]) -> list[dict]:
+        # Coordinates start at 1
+        return [{'range': rowcol_to_a1(row_number + 1, k + 1), 'values': [[v]]} for k, v in updates_by_column.items()]
+
+    def _update_cells(self, worksheet: gspread.Worksheet, cells: list[dict]) -> None:
+        # The values are interpreted the same way as if they were typed in, just like update_cell does
+        self.metrics.increment('google.writes')
+        self.api.execute(lambda: worksheet.batch_update(cells, value_input_option=ValueInputOption.user_entered))
+
+    def _add_rows(self, worksheet: gspread.Worksheet, rows_by_column: list[dict[int, str]]) -> None:
+        # The columns we don't have data for are left empty, so the values end up under the right headers
+        width = max((max(row.keys(), default=-1) + 1 for row in rows_by_column), default=0)
+        values = [[row.get(i, '') for i in range(width)] for row in rows_by_column]
 
-    def refresh(self) -> None:
+        # Appending again after a timeout could add the same rows twice, so the caller decides what to do after a failure
+        self.metrics.increment('google.writes')
+        self.api.execute(lambda: worksheet.append_rows(values), idempotent=False)
+
+    def refresh(self, force: bool = False) -> None:
         logger.info('Refreshing Google Sheets data')
+        start = time.perf_counter()
         try:
-            self._spreadsheet.on_next(self._load_spreadsheet())
+            # Nothing needs to be downloaded if the spreadsheet has not been modified since the last refresh
+            modified_time = self._load_modified_time()
+            if not force and modified_time and modified_time == self._modified_time:
+                logger.info('The spreadsheet has not been modified since the last refresh')
+                self.metrics.increment('google.skipped_refreshes')
+                self._live.on_next(True)
+                return
+
+            spreadsheet = self._load_spreadsheet()
+            values = self._load_batch_values(spreadsheet, self._sheet_names)
+            self._modified_time = modified_time
+
+            # Remember the layout of each sheet, so we can write to it without downloading it again
+            self._layouts = {name: GoogleSheetDatabase._make_layout(raw) for name, raw in values.items() if raw}
+
+            self._values.on_next(values)
+            self._live.on_next(True)
+            self._save_snapshot(values, modified_time)
         except Exception as e:
-            self._spreadsheet.on_error(e)
+            logger.exception(e)
+            self._recover(e)
+        finally:
+            duration = time.perf_counter() - start
+            self.metrics.observe('google.refresh', duration)
+            logger.info(f"Refreshing Google Sheets data took {duration:.2f} seconds")
 
     async def refresh_job(self, context) -> None:
-        self.refresh()
+        # The refresh talks to Google and parses the data, so it runs on its own thread to keep the bot responsive
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.refresh)
 
     def _table_data(self, sheet: str) -> Observable:
         return self._sheet_data(sheet, lambda data: GoogleSheetDatabase._parse_sheet_data(data))
@@ -152,11 +296,12 @@ class GoogleSheetDatabase:
         return self._sheet_data(sheet, lambda data: GoogleSheetDatabase._parse_tasks_data(data))
 
     def _sheet_data(self, sheet: str, parser: Callable) -> Observable:
+        self._sheet_names.append(sheet)
         cached_data = BehaviorSubject([])  # Start with an empty array until we get some data
 
-        self._spreadsheet.pipe(  # Start with the spreadsheet
-            op.map(lambda spreadsheet: GoogleSheetDatabase._load_worksheet(spreadsheet, sheet)),  # Load the sheet
-            op.map(lambda worksheet: GoogleSheetDatabase._load_values(worksheet)),  # Load the actual data
+        self._values.pipe(  # Start with the values of all the sheets
+            op.filter(lambda values: sheet in values),  # An older snapshot may not contain this sheet
+            op.map(lambda values: values[sheet]),  # Pick the data of this sheet
             op.distinct_until_changed(),  # Only propagate when the sheet data changes, because it rarely changes
             op.map(parser),  # Parse the data
         ).subscribe(
@@ -166,19 +311,114 @@ class GoogleSheetDatabase:
 
         return cached_data
 
-    def _load_spreadsheet(self) -> gspread.Spreadsheet:
-        logger.info(f"Loading spreadsheet {self.spreadsheet_key}")
-        return self.api.get_spreadsheet(self.spreadsheet_key)
+    @staticmethod
+    def _row_changes(source: Observable, key_name: str) -> Observable:
+        return source.pipe(
+            op.map(lambda rows: GoogleSheetDatabase._index_rows(rows, key_name)),  # Identify the rows by their key
+            op.start_with({}),  # The first data we get is all new
+            op.pairwise(),  # Compare each version of the data with the previous one
+            op.map(lambda pair: SheetChanges.between(pair[0], pair[1])),
+            op.filter(lambda changes: not changes.is_empty),
+        )
 
     @staticmethod
-    def _load_worksheet(spreadsheet: gspread.Spreadsheet, sheet_name: str) -> gspread.Worksheet:
+    def _index_rows(rows: list[dict], key_name: str) -> dict[str, dict]:
+        # Rows without a key cannot be identified, so they are left out
+        indexed = {}
+        for row in rows:
+            key = row.get(key_name, '').strip()
+            if not key:
+                continue
+
+            # Just like the writes, which go to the last row with the key, the last duplicate wins
+            if key in indexed:
+                logger.warning(f"There is more than one row with the {key_name} {key}; only the last one is used")
+            indexed[key] = row
+        return indexed
+
+    def _load_snapshot(self) -> bool:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as file:
+                snapshot = json.load(file)
+            values = snapshot['values']
+
+            # The snapshot can only stand in for the live data if it contains all the sheets
+            if all(name in values for name in self._sheet_names):
+                self._modified_time = snapshot.get('modified_time')
+            self._layouts = {name: GoogleSheetDatabase._make_layout(raw) for name, raw in values.items() if raw}
+
+            self._values.on_next(values)
+            logger.info(f"Loaded the Google Sheets data from the snapshot at {self.snapshot_path}")
+            return True
+        except Exception as e:
+            logger.warning(f"Could not load the snapshot at {self.snapshot_path}: {e}")
+            return False
+
+    def _save_snapshot(self, values: dict[str, list[list]], modified_time: Optional[str]) -> None:
+        if not self.snapshot_path:
+            return
+
+        try:
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            # Write to a temporary file first, so a crash never leaves a half-written snapshot behind
+            temporary_path = self.snapshot_path + '.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump({'modified_time': modified_time, 'values': values}, file, separators=(',', ':'))
+            os.replace(temporary_path, self.snapshot_path)
+        except Exception as e:
+            logger.warning(f"Could not save the snapshot at {self.snapshot_path}: {e}")
+
+    def _load_modified_time(self) -> Optional[str]:
+        try:
+            self.metrics.increment('google.reads')
+            return self.api.get_modified_time(self.spreadsheet_key, Priority.BACKGROUND)
+        except Exception as e:
+            # Without the modified time we can still download everything
+            logger.warning(f"Could not check when the spreadsheet was modified: {e}")
+            return None
+
+    def _load_spreadsheet(self) -> gspread.Spreadsheet:
+        logger.debug(f"Loading spreadsheet {self.spreadsheet_key}")
+        return self.api.get_spreadsheet(self.spreadsheet_key, Priority.BACKGROUND)
+
+    def _load_worksheet(self, sheet_name: str) -> gspread.Worksheet:
         logger.debug(f"Loading worksheet {sheet_name}")
-        return spreadsheet.worksheet(sheet_name)
+        return self.api.get_worksheet(self.spreadsheet_key, sheet_name)
 
-    @staticmethod
-    def _load_values(worksheet: gspread.Worksheet) -> list[list]:
+    def _recover(self, error: Exception) -> None:
+        # Anything we know about the sheets may be outdated after an error
+        self._layouts = {}
+        self.api.recover(error)
+
+    def _load_values(self, worksheet: gspread.Worksheet) -> list[list]:
         logger.debug(f"Loading worksheet values")
-        return worksheet.get_values()
+        self.metrics.increment('google.reads')
+        return self.api.execute(lambda: worksheet.get_values())
+
+    def _load_batch_values(self, spreadsheet: gspread.Spreadsheet, sheet_names: list[str]) -> dict[str, list[list]]:
+        logger.debug(f"Loading values for worksheets {sheet_names}")
+        self.metrics.increment('google.reads')
+        response = self.api.execute(lambda: spreadsheet.values_batch_get([absolute_range_name(name) for name in sheet_names]), Priority.BACKGROUND)
+
+        # The ranges come back in the order they were requested; the rows are padded just like get_values does
+        value_ranges = response.get('valueRanges', [])
+        return {name: fill_gaps(value_range.get('values', [])) for name, value_range in zip(sheet_names, value_ranges)}
+
+    @staticmethod
+    def _make_layout(raw: list[list]) -> SheetLayout:
+        header = raw[0]
+        rows = raw[1:]
+
+        # Map the header keys to their column numbers - instead of A, B, C we use 0, 1, 2
+        columns = {GoogleSheetDatabase._header_to_key(h): i for i, h in enumerate(header)}
+
+        return SheetLayout(header, columns, rows)
 
     @staticmethod
     def _parse_sheet_data(raw: list[list]) -> list[dict]:
@@ -202,12 +442,16 @@ class GoogleSheetDatabase:
 
         tasks = []
 
-        for row in raw[2:]:
+        # The tasks start on the third row; coordinates start at 1
+        for row_number, row in enumerate(raw[2:], start=3):
             for weekday in range(0, len(row) // cols):
                 start = weekday * cols
                 end = start + cols
                 task = dict(zip(keys, row[start:end]))
                 task['weekday'] = weekday
+                # Remember where the task is, so we can check it off without searching the sheet
+                task['row_number'] = row_number
+                task['column_number'] = start + 1
                 tasks.append(task)
 
         return tasks
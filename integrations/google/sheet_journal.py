@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+Row = dict[str, str]
+
+
+# Remembers the rows that were created locally until they are safely in the sheet, so they survive a crash or a restart
+# The journal is an append-only file, where every line either adds a row or marks some rows as written
+# Without a path the rows are only kept in memory
+class GoogleSheetJournal:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._rows: dict[str, Row] = {}
+
+        if path:
+            self._rows = GoogleSheetJournal._read(path)
+            self._compact()
+            if self._rows:
+                logger.info(f"Recovered {len(self._rows)} rows from the journal at {path}")
+
+    def rows(self) -> dict[str, Row]:
+        with self._lock:
+            return self._rows.copy()
+
+    def append(self, row: Row) -> str:
+        key = uuid.uuid4().hex
+        with self._lock:
+            # The row must be on disk before we report it as created
+            self._write({'key': key, 'row': row})
+            self._rows[key] = row
+        return key
+
+    def remove(self, keys: list[str]) -> None:
+        with self._lock:
+            keys = [key for key in keys if key in self._rows]
+            if not keys:
+                return
+
+            self._write({'written': keys})
+            for key in keys:
+                del self._rows[key]
+
+            # Start a fresh file once everything was written, so the journal doesn't grow forever
+            if not self._rows:
+                self._compact()
+
+    def _write(self, record: dict) -> None:
+        if not self.path:
+            return
+
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _compact(self) -> None:
+        if not self.path:
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first, so a crash never leaves a half-written journal behind
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            for key, row in self._rows.items():
+                file.write(json.dumps({'key': key, 'row': row}, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.path)
+
+    @staticmethod
+    def _read(path: str) -> dict[str, Row]:
+        rows: dict[str, Row] = {}
+        if not os.path.exists(path):
+            return rows
+
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave the last line half-written; that row was never reported as created
+                    logger.warning(f"Skipping a broken line in the journal at {path}")
+                    continue
+
+                if 'row' in record:
+                    rows[record['key']] = record['row']
+                for key in record.get('written', []):
+                    rows.pop(key, None)
+        return rows
@@ -0,0 +1,32 @@
+from typing import Optional
+
+
+# The column map and row locations of a sheet, as they were when the sheet was last downloaded
+# This allows us to write to the right cells without downloading the whole sheet again before every write
+class SheetLayout:
+    def __init__(self, header: list[str], columns: dict[str, int], rows: list[list[str]]):
+        self.header = header
+        self.columns = columns
+        self._rows = rows
+        self._row_numbers_by_key: dict[str, dict[str, int]] = {}
+
+    def row_numbers(self, key_name: str) -> dict[str, int]:
+        # The rows are indexed by the value in the key column, only when we need to look them up
+        if key_name not in self._row_numbers_by_key:
+            key_column = self.columns[key_name]
+            self._row_numbers_by_key[key_name] = {row[key_column]: i for i, row in enumerate(self._rows) if key_column < len(row)}
+        return self._row_numbers_by_key[key_name]
+
+    def row_number(self, key_name: str, key: str) -> Optional[int]:
+        return self.row_numbers(key_name).get(key)
+
+    def matches_header(self, header: list[str]) -> bool:
+        # Empty cells at the end of the header are not returned by every API call
+        return SheetLayout._trim(self.header) == SheetLayout._trim(header)
+
+    @staticmethod
+    def _trim(row: list[str]) -> list[str]:
+        trimmed = list(row)
+        while trimmed and not trimmed[-1]:
+            trimmed.pop()
+        return trimmed
@@ -2,92 +2,138 @@ import pytz
 import random
 
 from typing import Optional
-from itertools import groupby
+from collections import Counter
 from datetime import datetime
 
 from readerwriterlock import rwlock
 
 from data.repositories.raffle import RaffleRepository
 from data.models.user import User
-from data.models.raffle_entry import RaffleEntry
+from data.models.raffle_entry import RaffleEntry, countries
 
 from integrations.google.sheet_database import GoogleSheetDatabase
-
-countries = [
-    'Albania',
-    'Austria',
-    'Belgium',
-    'Croatia',
-    'Czech Republic',
-    'Denmark',
-    'England',
-    'France',
-    'Georgia',
-    'Germany',
-    'Hungary',
-    'Italy',
-    'Netherlands',
-    'Poland',
-    'Portgal',
-    'Romania',
-    'Scotland',
-    'Serbia',
-    'Slovakia',
-    'Slovenia',
-    'Spain',
-    'Switzerland',
-    'Turkey',
-    'Ukraine',
-]
+from integrations.google.sheet_journal import GoogleSheetJournal
+from integrations.google.sheet_write_queue import GoogleSheetWriteQueue
 
 
 class GoogleSheetRaffleRepository(RaffleRepository):
-    def __init__(self, database: GoogleSheetDatabase, timezone: pytz.timezone = None):
+    def __init__(self, database: GoogleSheetDatabase, timezone: pytz.timezone = None, write_delay: float = 5.0, journal_path: str = None):
         self.timezone = timezone
 
         self.entries: list[RaffleEntry] = []
         self.entries_by_full_name: dict[str, list[RaffleEntry]] = {}
+        self.counts_by_full_name: dict[str, int] = {}
 
         # The repository data can be read and refreshed from different threads,
         # so any data operation needs to be protected
         self.lock = rwlock.RWLockWrite()
 
         self.database = database
+        # The new entries are saved locally first, and written to the database in batches, in the background
+        # They stay in the journal until they are in the sheet, so no sold ticket is lost if we crash in the meantime
+        self.journal = GoogleSheetJournal(journal_path)
+        recovered = self.journal.rows()
+        # The entries left in the journal by a crash, or by a failed write, may have reached the sheet anyway
+        self._unconfirmed: set[str] = set(recovered.keys())
+        self.writes = GoogleSheetWriteQueue(self._write, delay=write_delay, metrics=database.metrics)
+        if recovered:
+            self.writes.put(recovered)
+
         self.database.raffle.subscribe(self._load)
 
     def get_by_user(self, user: User) -> list[RaffleEntry]:
         with self.lock.gen_rlock():
-            return self.entries_by_full_name.get(user.full_name, [])
+            return list(self.entries_by_full_name.get(user.full_name, []))
+
+    def count_by_user(self, user: User) -> int:
+        with self.lock.gen_rlock():
+            return self.counts_by_full_name.get(user.full_name, 0)
 
     def list_by_user(self) -> dict[str, list[RaffleEntry]]:
         with self.lock.gen_rlock():
-            return self.entries_by_full_name.copy()
+            return {full_name: list(entries) for full_name, entries in self.entries_by_full_name.items()}
 
     def create(self, user: User) -> RaffleEntry:
+        entry = RaffleEntry(
+            full_name=user.full_name,
+            created_at=datetime.now(tz=self.timezone),
+            country=random.choice(countries)
+        )
+        self.add(entry)
+        return entry
+
+    def add(self, entry: RaffleEntry) -> None:
+        # Adds an entry that was already created elsewhere, e.g. by another repository that we mirror
+        row = self._to_row(entry)
+
+        # The entry is recorded in the journal and in memory together, so a refresh can't see only one of them
         with self.lock.gen_wlock():
-            entry = RaffleEntry(
-                full_name=user.full_name,
-                created_at=datetime.now(tz=self.timezone),
-                country=random.choice(countries)
-            )
+            key = self.journal.append(row)
+            self._index(entry)
 
-            self.entries.append(entry)
-            if entry.full_name in self.entries_by_full_name:
-                self.entries_by_full_name[entry.full_name].append(entry)
-            else:
-                self.entries_by_full_name[entry.full_name] = [entry]
+        self.writes.put({key: row})
 
-            self.database.add_raffle_entry(self._to_row(entry))
+    def close(self) -> None:
+        # Make sure that all the queued entries reach the database
+        self.writes.close()
 
-            return entry
+    def _write(self, data: dict[str, dict[str, str]]) -> None:
+        # The entries we have already seen in the sheet were written before a restart, so they are not added again
+        journal_rows = self.journal.rows()
+        keys = [key for key in data.keys() if key in journal_rows]
+
+        # The entries that may be in the sheet already are checked against the live sheet first, or they would
+        # be appended twice; the refresh may not have run yet, and the snapshot is older than the journal
+        unconfirmed = {key: journal_rows[key] for key in keys if key in self._unconfirmed}
+        if unconfirmed:
+            written = GoogleSheetRaffleRepository._find_written(self.database.load_raffle_entries(), unconfirmed)
+            self.journal.remove(written)
+            keys = [key for key in keys if key not in written]
+
+        try:
+            self.database.add_raffle_entries([journal_rows[key] for key in keys])
+        except Exception:
+            # The queue will try again, and by then we can't know whether these went through
+            self._unconfirmed.update(keys)
+            raise
+
+        self.journal.remove(keys)
+        self._unconfirmed.difference_update(data.keys())
+
+    def _index(self, entry: RaffleEntry) -> None:
+        self.entries.append(entry)
+        self.entries_by_full_name.setdefault(entry.full_name, []).append(entry)
+        self.counts_by_full_name[entry.full_name] = self.counts_by_full_name.get(entry.full_name, 0) + 1
 
     def _load(self, raw_data: list[dict[str, str]]) -> None:
         with self.lock.gen_wlock():
-            raw_entries = [self._from_row(row) for row in raw_data]
-            self.entries = [entry for entry in raw_entries if entry]
+            # The journal entries that are already in the sheet have been written, the others are still on their way
+            journal_rows = self.journal.rows()
+            written = GoogleSheetRaffleRepository._find_written(raw_data, journal_rows)
+            self.journal.remove(written)
+            pending = [row for key, row in journal_rows.items() if key not in written]
+
+            raw_entries = [self._from_row(row) for row in raw_data + pending]
+            self.entries = []
+            self.entries_by_full_name = {}
+            self.counts_by_full_name = {}
+            for entry in raw_entries:
+                if entry:
+                    self._index(entry)
 
-            sorted_entries = sorted(self.entries, key=lambda entry: entry.full_name)
-            self.entries_by_full_name = {key: list(group) for key, group in groupby(sorted_entries, key=lambda entry: entry.full_name)}
+    @staticmethod
+    def _find_written(raw_data: list[dict[str, str]], journal_rows: dict[str, dict[str, str]]) -> list[str]:
+        # The same row can appear more than once, so every row in the sheet only confirms a single journal entry
+        keys = ('champion_name', 'date', 'country')
+        available = Counter(tuple(row.get(k, '').strip() for k in keys) for row in raw_data)
+
+        written = []
+        for key, row in journal_rows.items():
+            values = tuple(str(row.get(k, '')).strip() for k in keys)
+            if available[values] > 0:
+                available[values] -= 1
+                written.append(key)
+        return written
 
     def _from_row(self, row: dict[str, str]) -> Optional[RaffleEntry]:
         full_name = row.get('champion_name', '').strip()
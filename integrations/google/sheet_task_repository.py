@@ -19,6 +19,7 @@ class GoogleSheetTaskRepository(TaskRepository):
         self.timezone = timezone
 
         self.tasks: list[TaskHandle] = []
+        self.cells_by_task: dict[Task, dict[str, str]] = {}
 
         # The repository data can be read and refreshed from different threads,
         # so any data operation needs to be protected
@@ -27,6 +28,10 @@ class GoogleSheetTaskRepository(TaskRepository):
         self.database = database
         database.tasks.subscribe(self._load)
 
+    def get_all_tasks(self) -> list[Task]:
+        with self.lock.gen_rlock():
+            return TaskHandle.unwrap_list(self.tasks)
+
     def get_tasks_between(self, start: datetime, end: datetime) -> list[Task]:
         weekday = start.weekday()
         start_time = start.time()
@@ -37,25 +42,31 @@ class GoogleSheetTaskRepository(TaskRepository):
     def toggle(self, task: Task) -> Task:
         new_task = task.copy(is_done=not task.is_done)
 
+        with self.lock.gen_rlock():
+            cell = self.cells_by_task.get(new_task, {})
+
+        # The sheet is written first, so a failed write doesn't leave the task toggled only in memory
+        self.database.check_task(self._to_row(new_task) | cell)
+
         with self.lock.gen_wlock():
             # Only existing tasks can be toggled
             existing = next((handle for handle in self.tasks if handle.inner == task), None)
             if existing:
                 existing.inner = new_task
 
-            self.database.check_task(self._to_row(new_task))
-
         return new_task
 
     def _load(self, raw_data: list[dict[str, str]]) -> None:
         with self.lock.gen_wlock():
             last_times = [self._parse_time('08:00') for i in range(0, 7)]
             self.tasks = []
+            self.cells_by_task = {}
             for row in raw_data:
                 task = self._from_row(row, last_times)
                 if task:
                     last_times[task.weekday] = task.time
                     self.tasks.append(TaskHandle(task))
+                    self.cells_by_task[task] = {k: str(row[k]) for k in ('row_number', 'column_number') if k in row}
 
     def _from_row(self, row: dict[str, str], last_times: list[time]) -> Optional[Task]:
         # If the name is not provided, this indicates an empty row
@@ -1,7 +1,8 @@
 import pytz
 
 from typing import Optional, Union
-from itertools import groupby
+from itertools import takewhile, islice
+from bisect import bisect_left, insort
 from datetime import date, datetime
 
 from readerwriterlock import rwlock
@@ -12,28 +13,36 @@ from data.models.user_role import UserRole
 
 from integrations.google.handle import Handle
 from integrations.google.sheet_database import GoogleSheetDatabase
+from integrations.google.sheet_changes import SheetChanges
+from integrations.google.sheet_write_queue import GoogleSheetWriteQueue
 
 UserHandle = Handle[User]
 
 
 class GoogleSheetUserRepository(UserRepository):
-    def __init__(self, database: GoogleSheetDatabase, timezone: pytz.timezone = None):
+    def __init__(self, database: GoogleSheetDatabase, timezone: pytz.timezone = None, write_delay: float = 5.0):
         self.timezone = timezone
 
-        self.users: list[UserHandle] = []
         self.users_by_full_name: dict[str, UserHandle] = {}
         self.users_by_telegram_id: dict[int, UserHandle] = {}
         self.users_by_telegram_name: dict[str, UserHandle] = {}
         self.users_by_birthday: dict[str, list[UserHandle]] = {}
-        self.users_by_loyverse_id: dict[str, list[UserHandle]] = {}
+        self.users_by_loyverse_id: dict[str, UserHandle] = {}
         self.users_search: dict[str, set[UserHandle]] = {}
+        self.users_search_keys: list[str] = []  # Sorted, for prefix searches
 
         # The repository data can be read and refreshed from different threads,
         # so any data operation needs to be protected
         self.lock = rwlock.RWLockWrite()
 
         self.database = database
-        database.users.subscribe(self._load)
+        # The changes are written to the database in the background, so saving never waits for Google
+        self.writes = GoogleSheetWriteQueue(
+            lambda data: database.save_users('full_name', data),
+            delay=write_delay,
+            metrics=database.metrics,
+        )
+        database.user_changes.subscribe(self._load)
 
     def get_by_full_name(self, full_name: str) -> Optional[User]:
         with self.lock.gen_rlock():
@@ -61,8 +70,13 @@ class GoogleSheetUserRepository(UserRepository):
             query = query.lower()
 
             # A direct match is a successful prefix search; this is usually what we want
+            # E.g. The entry for Alex will match Alex Uzan, Alexandru Ivanciu, and Alexandra Tudor
             if query in self.users_search:
-                return Handle.unwrap_set(self.users_search[query])
+                results: set[UserHandle] = set()
+                start = bisect_left(self.users_search_keys, query)
+                for key in takewhile(lambda k: k.startswith(query), islice(self.users_search_keys, start, None)):
+                    results |= self.users_search[key]
+                return Handle.unwrap_set(results)
 
             # No direct matches -> do a full search
             results: set[UserHandle] = set()
@@ -83,7 +97,7 @@ class GoogleSheetUserRepository(UserRepository):
             diff_data = {}
             for user in users:
                 # Only existing users are saved
-                handle = self.users_by_full_name[user.full_name]
+                handle = self.users_by_full_name.get(user.full_name)
                 if not handle:
                     continue
 
@@ -93,66 +107,106 @@ class GoogleSheetUserRepository(UserRepository):
                     continue
 
                 # Update the repository directly
-                handle.inner = user
+                self._replace(handle, user)
                 # Queue the user for update in the database
                 diff_data[user.full_name] = diff
 
-            # Save changes to the database as well
+            # Queue the changes for the database as well
             if diff_data:
-                self.database.save_users('full_name', diff_data)
+                self.writes.put(diff_data)
+
+    def close(self) -> None:
+        # Make sure that all the queued changes reach the database
+        self.writes.close()
+
+    def pending_changes(self) -> set[str]:
+        # The full names of the users whose changes have not reached the database yet
+        return set(self.writes.pending().keys())
 
-    def _load(self, raw_data: list[dict[str, str]]) -> None:
+    def _load(self, changes: SheetChanges) -> None:
+        # Only the rows that have changed are parsed and indexed, so the lock is held for as little as possible
         with self.lock.gen_wlock():
-            raw_users = [self._from_row(row) for row in raw_data]
-            self.users = [UserHandle(user) for user in raw_users if user]
-
-            self.users_by_full_name = {handle.inner.full_name: handle for handle in self.users if handle.inner}
-            self.users_by_telegram_id = {handle.inner.telegram_id: handle for handle in self.users if handle.inner.telegram_id}
-            self.users_by_telegram_name = {handle.inner.telegram_username: handle for handle in self.users if handle.inner.telegram_username}
-            self.users_by_loyverse_id = {handle.inner.loyverse_id: handle for handle in self.users if handle.inner.loyverse_id}
-
-            users_with_birthday = [handle for handle in self.users if handle.inner.birthday]
-            sorted_birthdays = sorted(users_with_birthday, key=lambda handle: handle.inner.birthday)
-            self.users_by_birthday = {key: list(group) for key, group in groupby(sorted_birthdays, key=lambda handle: handle.inner.birthday)}
-
-            self.users_search = {}
-            # Complete telegram username
-            self._add_to_search({handle.inner.telegram_username.lower(): handle for handle in self.users if handle.inner.telegram_username})
-            for handle in self.users:
-                # Complete alias list
-                self._add_to_search({alias.lower(): handle for alias in handle.inner.aliases})
-                # First name from full name
-                self._add_to_search({handle.inner.first_name.lower(): handle})
-            # Complete full name
-            self._add_to_search({handle.inner.full_name.lower(): handle for handle in self.users if handle.inner})
-
-            self._merge_search_prefixes()
-
-    # E.g. The entry for Alex will match Alex Uzan, Alexandru Ivanciu, and Alexandra Tudor
-    # Without this, it would only match Alex Uzan
-    def _merge_search_prefixes(self) -> None:
-        sorted_keys = list(self.users_search.keys())
-        sorted_keys.sort()
-
-        prefix_i = 0
-        current_i = 1
-
-        while current_i < len(sorted_keys):
-            prefix = sorted_keys[prefix_i]
-            key = sorted_keys[current_i]
-            if key.startswith(prefix):
-                self.users_search[prefix] |= self.users_search[sorted_keys[current_i]]
-                current_i = current_i + 1
-            else:
-                prefix_i = prefix_i + 1
-                current_i = prefix_i + 1
-
-    def _add_to_search(self, entries: dict[str, UserHandle]) -> None:
-        for key, user in entries.items():
-            if key in self.users_search:
-                self.users_search[key].add(user)
-            else:
-                self.users_search[key] = {user}
+            # Changes that are still queued for the database take precedence over the data we just loaded
+            # The queue is read under the lock, so a save can't slip in between and be overwritten by the older sheet data
+            pending = self.writes.pending()
+            added = [self._from_row(GoogleSheetUserRepository._with_pending(row, pending)) for row in changes.added]
+            modified = [self._from_row(GoogleSheetUserRepository._with_pending(row, pending)) for row in changes.modified]
+            removed = [row.get('full_name', '').strip() for row in changes.removed]
+
+            for full_name in removed:
+                handle = self.users_by_full_name.get(full_name)
+                if handle:
+                    self._unindex(handle)
+
+            for user in modified:
+                handle = self.users_by_full_name.get(user.full_name)
+                if handle:
+                    self._replace(handle, user)
+                else:
+                    self._index(UserHandle(user))
+
+            for user in added:
+                self._index(UserHandle(user))
+
+    def _replace(self, handle: UserHandle, user: User) -> None:
+        self._unindex(handle)
+        handle.inner = user
+        self._index(handle)
+
+    def _index(self, handle: UserHandle) -> None:
+        user = handle.inner
+        self.users_by_full_name[user.full_name] = handle
+        if user.telegram_id:
+            self.users_by_telegram_id[user.telegram_id] = handle
+        if user.telegram_username:
+            self.users_by_telegram_name[user.telegram_username] = handle
+        if user.loyverse_id:
+            self.users_by_loyverse_id[user.loyverse_id] = handle
+        if user.birthday:
+            self.users_by_birthday.setdefault(user.birthday, []).append(handle)
+
+        for key in GoogleSheetUserRepository._search_keys(user):
+            if key not in self.users_search:
+                self.users_search[key] = set()
+                insort(self.users_search_keys, key)
+            self.users_search[key].add(handle)
+
+    def _unindex(self, handle: UserHandle) -> None:
+        user = handle.inner
+        GoogleSheetUserRepository._remove_from_index(self.users_by_full_name, user.full_name, handle)
+        GoogleSheetUserRepository._remove_from_index(self.users_by_telegram_id, user.telegram_id, handle)
+        GoogleSheetUserRepository._remove_from_index(self.users_by_telegram_name, user.telegram_username, handle)
+        GoogleSheetUserRepository._remove_from_index(self.users_by_loyverse_id, user.loyverse_id, handle)
+
+        birthday_handles = self.users_by_birthday.get(user.birthday, [])
+        birthday_handles[:] = [h for h in birthday_handles if h is not handle]
+        if not birthday_handles:
+            self.users_by_birthday.pop(user.birthday, None)
+
+        for key in GoogleSheetUserRepository._search_keys(user):
+            handles = self.users_search.get(key)
+            if handles is None:
+                continue
+            handles.discard(handle)
+            if not handles:
+                del self.users_search[key]
+                del self.users_search_keys[bisect_left(self.users_search_keys, key)]
+
+    @staticmethod
+    def _remove_from_index(index: dict, key, handle: UserHandle) -> None:
+        # Another user may have taken over the key in the meantime, so only our own entry is removed
+        if key and index.get(key) is handle:
+            del index[key]
+
+    @staticmethod
+    def _search_keys(user: User) -> set[str]:
+        # Complete telegram username, complete alias list, first name and complete full name
+        keys = {alias.lower() for alias in user.aliases}
+        keys.add(user.first_name.lower())
+        keys.add(user.full_name.lower())
+        if user.telegram_username:
+            keys.add(user.telegram_username.lower())
+        return keys
 
     def _from_row(self, row: dict[str, str]) -> Optional[User]:
         # The full name is required, because we use it for saving
@@ -188,6 +242,14 @@ class GoogleSheetUserRepository(UserRepository):
             'recent_visits': user.recent_visits,
         }
 
+    @staticmethod
+    def _with_pending(row: dict[str, str], pending: dict[str, dict[str, str]]) -> dict[str, str]:
+        diff = pending.get(row.get('full_name', '').strip())
+        if not diff:
+            return row
+
+        return row | {k: '' if v is None else str(v) for k, v in diff.items()}
+
     @staticmethod
     def _diff(a: User, b: User) -> dict[str, str]:
         a_row = GoogleSheetUserRepository._to_row(a)
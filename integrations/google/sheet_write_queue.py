@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from helpers.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+RowDiff = dict[str, str]
+Writer = Callable[[dict[str, RowDiff]], dict[str, bool]]
+
+
+# Collects row changes and writes them to the sheet in the background, so the callers never wait for Google
+# Repeated changes to the same row within the delay window are merged together and written as a single batch
+# Every call already goes through GoogleRequestScheduler, which retries the short hiccups; a batch that still fails
+# goes back into the queue, under any newer changes to the same rows, and is tried again after a growing delay,
+# because the repositories already show the changes and they must reach the sheet eventually
+class GoogleSheetWriteQueue:
+    def __init__(self, writer: Writer, delay: float = 5.0, retry_delay: float = 5.0, max_retry_delay: float = 300.0, metrics: Metrics = None):
+        self.writer = writer
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.metrics = metrics or Metrics()
+
+        self._condition = threading.Condition()
+        self._pending: dict[str, RowDiff] = {}
+        self._in_flight: dict[str, RowDiff] = {}
+        self._first_pending_at: Optional[float] = None
+        self._retry_at: Optional[float] = None
+        self._failures = 0
+        self._closed = False
+
+        self._worker = threading.Thread(target=self._run, name='GoogleSheetWriteQueue', daemon=True)
+        self._worker.start()
+
+    def put(self, data: dict[str, RowDiff]) -> None:
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The write queue has been closed')
+
+            for key, diff in data.items():
+                GoogleSheetWriteQueue._merge(self._pending, key, diff)
+            self.metrics.increment('google.queued_rows', len(data))
+
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            self._condition.notify_all()
+
+    def pending(self) -> dict[str, RowDiff]:
+        # The changes that have not reached the sheet yet, including the ones being written right now
+        with self._condition:
+            merged = {key: diff.copy() for key, diff in self._in_flight.items()}
+            for key, diff in self._pending.items():
+                GoogleSheetWriteQueue._merge(merged, key, diff)
+            return merged
+
+    def close(self, timeout: float = 30.0) -> None:
+        # Anything still pending is written immediately, without waiting for the delay window
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join(timeout)
+
+        if self._worker.is_alive():
+            lost = self.pending()
+            logger.error(f"The write queue could not be flushed within {timeout} seconds, {len(lost)} rows were not written: {lost}")
+            self.metrics.increment('google.lost_rows', len(lost))
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+                # Wait until the window closes, so that a burst of changes is written together
+                # After a failure, wait for the backoff as well, even when closing
+                while True:
+                    remaining = self._remaining()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                self._in_flight = self._pending
+                self._pending = {}
+                self._first_pending_at = None
+
+            succeeded = self._flush(self._in_flight)
+
+            with self._condition:
+                if succeeded:
+                    self._failures = 0
+                    self._retry_at = None
+                else:
+                    self._requeue()
+                self._in_flight = {}
+
+    def _remaining(self) -> float:
+        now = time.monotonic()
+        waits = [self._retry_at - now] if self._retry_at is not None else []
+        if not self._closed:
+            waits.append(self._first_pending_at + self.delay - now)
+        return max(waits, default=0)
+
+    def _requeue(self) -> None:
+        # The newer changes are applied on top of the failed ones, so they still win
+        retry = self._in_flight
+        for key, diff in self._pending.items():
+            GoogleSheetWriteQueue._merge(retry, key, diff)
+        self._pending = retry
+        if self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+
+        self._failures += 1
+        delay = min(self.retry_delay * (2 ** (self._failures - 1)), self.max_retry_delay)
+        self._retry_at = time.monotonic() + delay
+        self.metrics.increment('google.write_retries')
+        logger.error(f"Could not write {len(retry)} rows, trying again in {delay:.1f} seconds (failure {self._failures})")
+
+    def _flush(self, data: dict[str, RowDiff]) -> bool:
+        try:
+            self.metrics.increment('google.write_flushes')
+            self.writer(data)
+            return True
+        except Exception as e:
+            logger.exception(e)
+            return False
+
+    @staticmethod
+    def _merge(target: dict[str, RowDiff], key: str, diff: RowDiff) -> None:
+        if key in target:
+            target[key].update(diff)
+        else:
+            target[key] = diff.copy()
@@ -0,0 +1,362 @@
+import asyncio
+import logging
+import httpx
+import json
+import pytz
+import time
+from typing import Optional, AsyncIterator
+from datetime import datetime
+from urllib.parse import quote
+
+import helpers.json
+from helpers.points import Points
+from helpers.metrics import Metrics
+from helpers.ttl_cache import TtlCache
+
+from data.models.user import User
+from data.repositories.user import UserRepository
+
+from integrations.loyverse.customer import Customer
+from integrations.loyverse.customer_directory import CustomerDirectory
+from integrations.loyverse.points_queue import PointsAdjustmentQueue
+from integrations.loyverse.receipt import Receipt
+from integrations.loyverse.request_policy import LoyverseRequestPolicy
+from integrations.loyverse.exceptions import InsufficientFundsError, InvalidCustomerError, LoyverseApiError
+
+logger = logging.getLogger(__name__)
+
+
+# The calls to Loyverse are awaited, so a slow response doesn't block the event loop
+# and the bot can handle other updates in the meantime
+class AsyncLoyverseApi:
+    BASE_URL = "https://api.loyverse.com/v1.0"
+
+    def __init__(self, token: str, users: UserRepository, read_only: bool = False, timeout: float = 30.0, connect_timeout: float = 5.0, pool_size: int = 10, unknown_customer_ttl: float = 3600.0, customer_ttl: float = 30.0, points_window: float = 1.0, points_audit_path: Optional[str] = None, requests_per_minute: int = 60, max_retries: int = 4, base_url: str = BASE_URL):
+        self.token = token
+        self.users = users
+        self.read_only = read_only
+        self.customers_endpoint = f"{base_url}/customers"
+        self.receipts_endpoint = f"{base_url}/receipts"
+        self.metrics = Metrics()
+        self.policy = LoyverseRequestPolicy(requests_per_minute, max_retries)
+
+        # We look up the customers locally, so we don't have to go through the whole customer list every time
+        self.customers = CustomerDirectory()
+        # The customers that are not linked to any user; they don't stay here for long, in case they join the community
+        self.unknown_customers: TtlCache[str, bool] = TtlCache(unknown_customer_ttl, max_size=10000)
+        # The customers we loaded or saved recently, so tapping the balance button a few times in a row doesn't call Loyverse every time
+        # The cache only holds copies, because the callers change the points of the customers they get
+        self.customer_cache: TtlCache[str, Customer] = TtlCache(customer_ttl, max_size=1000)
+        self._sync_lock = asyncio.Lock()
+
+        # The balance is saved as an absolute value, so two updates of the same customer must not overlap or one of them gets lost
+        # There is one lock for every user whose points were changed, which is never more than the size of the community
+        self._balance_locks: dict[str, asyncio.Lock] = {}
+
+        # The points awarded to the same customer in a short while are saved together
+        self.points_queue = PointsAdjustmentQueue(self.add_points, points_window, points_audit_path, self.metrics)
+
+        # The client keeps the connections open between calls, and every call gives up after a while
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def get_balance(self, user: User) -> Points:
+        # Showing a balance that is a few seconds old is fine, so this is the only place where the customer cache is used
+        return (await self._get_customer(user, cached=True)).points
+
+    async def add_points(self, user: User, points: Points) -> None:
+        if points.is_zero:
+            return
+
+        async with self._balance_lock(user):
+            customer = await self._get_customer(user)
+            customer.points += points
+            await self._save_customer(customer)
+
+    async def remove_points(self, user: User, points: Points) -> None:
+        if points.is_zero:
+            return
+
+        async with self._balance_lock(user):
+            customer = await self._get_customer(user)
+            if customer.points < points:
+                raise InsufficientFundsError("You don't have enough points")
+
+            customer.points -= points
+            await self._save_customer(customer)
+
+    def queue_points(self, user: User, points: Points, reason: str) -> asyncio.Future:
+        # Unlike add_points, the points are saved a little later, together with any other points the user receives meanwhile
+        return self.points_queue.add(user, points, reason)
+
+    async def get_receipts(self, since: datetime) -> AsyncIterator[Receipt]:
+        since_utc = since.replace(microsecond=0).astimezone(pytz.utc).isoformat().replace('+00:00', 'Z')
+        limit = 50
+        cursor = None
+
+        # Emulate do-while
+        while True:
+            response = await self._request(
+                'get_receipts',
+                'GET',
+                self.receipts_endpoint,
+                params=AsyncLoyverseApi._params({'created_at_min': since_utc, 'limit': limit, 'cursor': cursor}),
+            )
+
+            # The failed page was already retried from the same cursor; stopping here would silently drop the rest of the visits
+            if response.status_code != 200:
+                raise LoyverseApiError(f"Loyverse get_receipts error {response.status_code} occurred.")
+
+            response_data = response.json()
+            raw_receipts = response_data.get('receipts', [])
+            cursor = response_data.get('cursor')
+
+            for raw_receipt in raw_receipts:
+                yield self._receipt_from_json(raw_receipt, since.tzinfo)
+
+            if not cursor or len(raw_receipts) < limit:
+                break
+
+    async def get_receipt(self, receipt_number: str, timezone: Optional[pytz.timezone] = None) -> Optional[Receipt]:
+        # The receipt number may come from outside, so it can't be allowed to reach any other endpoint
+        response = await self._request('get_receipt', 'GET', f"{self.receipts_endpoint}/{quote(receipt_number, safe='')}")
+
+        if response.status_code == 404:
+            return None
+
+        if response.status_code != 200:
+            raise LoyverseApiError(f"Loyverse get_receipt error {response.status_code} occurred.")
+
+        return self._receipt_from_json(response.json(), timezone)
+
+    async def get_user_by_customer_id(self, customer_id: str) -> Optional[User]:
+        user = self.users.get_by_loyverse_id(customer_id)
+        if user:
+            return user
+
+        # Most customers are walk-ins who are not in the community, so we only check them once in a while
+        if customer_id in self.unknown_customers:
+            self.metrics.increment('loyverse.unknown_customer_hits')
+            return None
+
+        return await self._initialize_user_by_customer(customer_id)
+
+    def forget_unknown_customers(self) -> None:
+        # The community has changed, so the unknown customers may have joined in the meantime
+        self.unknown_customers.clear()
+
+    async def close(self) -> None:
+        await self.points_queue.close()
+        await self.client.aclose()
+
+    def _receipt_from_json(self, raw_receipt: dict, timezone: Optional[pytz.timezone]) -> Receipt:
+        receipt = Receipt.from_json(raw_receipt, timezone)
+        # The receipt may have changed the points of the customer
+        if receipt.customer_id:
+            self.customer_cache.pop(receipt.customer_id)
+        return receipt
+
+    def _balance_lock(self, user: User) -> asyncio.Lock:
+        if user.full_name not in self._balance_locks:
+            self._balance_locks[user.full_name] = asyncio.Lock()
+        return self._balance_locks[user.full_name]
+
+    async def _get_customer(self, user: User, cached: bool = False) -> Customer:
+        customer = await self._get_single_customer(user.loyverse_id, cached) if user.loyverse_id else None
+
+        if not customer:
+            customer = await self._initialize_customer_by_user(user)
+
+        if not customer:
+            raise InvalidCustomerError(f"The user @{user.telegram_username} is not a recognized Loyverse customer.")
+
+        return customer
+
+    async def _get_single_customer(self, customer_id: str, cached: bool = False) -> Optional[Customer]:
+        # The balance updates must start from the real balance, or they would overwrite the points earned at the bar meanwhile
+        customer = self.customer_cache.get(customer_id) if cached else None
+        if customer:
+            self.metrics.increment('loyverse.customer_cache_hits')
+            return customer.copy()
+
+        raw_customer = await self._get_raw_customer(customer_id)
+        customer = Customer.from_json(raw_customer) if raw_customer else None
+        if customer:
+            self.customer_cache.set(customer_id, customer.copy())
+
+        return customer
+
+    async def _get_raw_customer(self, customer_id: str) -> Optional[dict]:
+        response = await self._request('get_customer', 'GET', f"{self.customers_endpoint}/{customer_id}")
+
+        if response.status_code != 200:
+            logger.error(f"Loyverse get_single_customer error {response.status_code} occurred.")
+            return None
+
+        return response.json()
+
+    async def _get_single_customer_by_username(self, username: str) -> Optional[Customer]:
+        # The directory only tells us who the customer is; the balance is always loaded fresh
+        customer_id = await self._find_customer_id(username)
+        return await self._get_single_customer(customer_id) if customer_id else None
+
+    async def _find_customer_id(self, username: str) -> Optional[str]:
+        if self.customers.is_known_missing(username):
+            return None
+
+        customer = self.customers.get_by_username(username)
+        synced = True
+        if not customer and self.customers.needs_sync:
+            async with self._sync_lock:
+                if self.customers.needs_sync:
+                    synced = await self._sync_customers()
+            customer = self.customers.get_by_username(username)
+
+        if not customer:
+            # Only a complete customer list can tell that there's no such customer
+            if synced and self.customers.is_built:
+                self.customers.remember_missing(username)
+            return None
+
+        return customer.customer_id
+
+    async def _initialize_customer_by_user(self, user: User) -> Optional[Customer]:
+        if not user.telegram_username:
+            return None
+
+        customer = await self._get_single_customer_by_username(user.telegram_username)
+        if not customer:
+            return None
+
+        self._link_user_to_customer(user, customer)
+
+        return customer
+
+    async def _initialize_user_by_customer(self, customer_id: str) -> Optional[User]:
+        # The directory already knows most customers; the balance doesn't matter here
+        customer = self.customers.get_by_id(customer_id)
+        if not customer:
+            raw_customer = await self._get_raw_customer(customer_id)
+            if raw_customer is None:
+                # The call failed, so we don't know anything about the customer yet
+                return None
+            customer = Customer.from_json(raw_customer)
+
+        user = self.users.get_by_telegram_name(customer.username) if customer else None
+        if not user:
+            self.unknown_customers.set(customer_id, True)
+            return None
+
+        return self._link_user_to_customer(user, customer)
+
+    def _link_user_to_customer(self, user: User, customer: Customer) -> User:
+        # Save the customer id to the user data for future reference
+        user = user.copy(loyverse_id=customer.customer_id)
+        self.users.save(user)
+        return user
+
+    async def _sync_customers(self) -> bool:
+        limit = 250
+        cursor = None
+        params = self.customers.sync_params()
+
+        # Emulate do-while
+        while True:
+            response = await self._request(
+                'get_customers',
+                'GET',
+                self.customers_endpoint,
+                params=AsyncLoyverseApi._params(params | {'limit': limit, 'cursor': cursor}),
+            )
+
+            if response.status_code != 200:
+                logger.error(f"Loyverse sync_customers error {response.status_code} occurred.")
+                return False
+
+            response_data = response.json()
+            raw_customers = response_data.get('customers', [])
+            cursor = response_data.get('cursor')
+
+            self.customers.update(raw_customers)
+
+            if not cursor or len(raw_customers) < limit:
+                break
+
+        self.customers.finish_sync()
+        return True
+
+    async def _save_customer(self, customer: Customer) -> None:
+        data = json.dumps(customer, default=helpers.json.default)
+        if self.read_only:
+            logger.info(data)
+            return
+
+        response = await self._request('save_customer', 'POST', self.customers_endpoint, content=data, headers={
+            "Content-Type": "application/json"
+        })
+
+        if response.status_code != 200:
+            # We don't know whether the change went through, so the next read has to ask Loyverse
+            self.customer_cache.pop(customer.customer_id)
+            raise LoyverseApiError(f"Loyverse save_customer error {response.status_code} occurred.")
+
+        self.customer_cache.set(customer.customer_id, customer.copy())
+        logger.info(response.json())
+
+    async def _request(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.policy.reserve())
+
+            response, error = None, None
+            try:
+                response = await self._send(endpoint, method, url, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+
+            status_code = response.status_code if response is not None else None
+            if status_code == 200:
+                return response
+
+            if not self.policy.should_retry(status_code, attempt):
+                self.metrics.increment(f'loyverse.{endpoint}.errors')
+                if error:
+                    raise LoyverseApiError(f"Loyverse {endpoint} failed: {error}") from error
+                return response
+
+            if status_code == 429:
+                self.metrics.increment(f'loyverse.{endpoint}.throttled')
+            self.metrics.increment(f'loyverse.{endpoint}.retries')
+
+            delay = self.policy.retry_delay(attempt, response.headers.get('Retry-After') if response is not None else None)
+            attempt += 1
+            logger.warning(f"Loyverse {endpoint} failed ({error or status_code}), retrying in {delay:.1f} seconds (attempt {attempt} of {self.policy.max_retries})")
+            await asyncio.sleep(delay)
+
+    async def _send(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        # The connection pool tells us when it has to open a new connection, so we know how often one is reused
+        connected = False
+
+        async def trace(event_name: str, info: dict) -> None:
+            nonlocal connected
+            if event_name == 'connection.connect_tcp.started':
+                connected = True
+
+        start = time.perf_counter()
+        try:
+            return await self.client.request(method, url, extensions={'trace': trace}, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            self.metrics.observe(f'loyverse.{endpoint}', duration)
+            self.metrics.increment('loyverse.calls')
+            self.metrics.increment(f'loyverse.{endpoint}.calls')
+            self.metrics.increment(f'loyverse.{endpoint}.new_connections' if connected else f'loyverse.{endpoint}.reused_connections')
+            logger.debug(f"Loyverse {endpoint} took {duration * 1000:.0f} ms on a {'new' if connected else 'reused'} connection")
+
+    @staticmethod
+    def _params(params: dict) -> dict:
+        # Unlike requests, httpx sends the empty parameters as well
+        return {k: v for k, v in params.items() if v is not None}
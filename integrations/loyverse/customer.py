@@ -10,6 +10,9 @@ class Customer:
         self.username = username
         self.points = points
 
+    def copy(self) -> "Customer":
+        return Customer(self.customer_id, self.name, self.username, self.points)
+
     def to_json(self) -> dict:
         return {
             'id': self.customer_id,
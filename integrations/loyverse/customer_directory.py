@@ -0,0 +1,90 @@
+import threading
+import time
+from typing import Callable, Optional
+
+from helpers.ttl_cache import TtlCache
+
+from integrations.loyverse.customer import Customer
+
+
+# A local copy of the Loyverse customer list, indexed by username (the customer note) and by id
+# It is downloaded in full only once; after that, we only ask Loyverse for the customers updated since the last sync
+# The balances in here get old quickly, so the directory is only meant for finding customers, not for reading their points
+class CustomerDirectory:
+    def __init__(self, sync_interval: float = 60.0, miss_ttl: float = 300.0, max_misses: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.sync_interval = sync_interval
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._by_id: dict[str, Customer] = {}
+        self._ids_by_username: dict[str, str] = {}
+        self._updated_since: Optional[str] = None
+        self._sync_updated_since: Optional[str] = None
+        self._synced_at: Optional[float] = None
+
+        # The usernames that we could not find, so we don't look for them again every time
+        self._misses: TtlCache[str, bool] = TtlCache(miss_ttl, max_misses, clock)
+
+    @property
+    def is_built(self) -> bool:
+        return self._synced_at is not None
+
+    @property
+    def needs_sync(self) -> bool:
+        return not self.is_built or self.clock() - self._synced_at >= self.sync_interval
+
+    def sync_params(self) -> dict[str, str]:
+        # After the first sync, we only need the customers that changed in the meantime
+        with self._lock:
+            return {'updated_at_min': self._updated_since} if self.is_built and self._updated_since else {}
+
+    def update(self, raw_customers: list[dict]) -> None:
+        with self._lock:
+            for raw_customer in raw_customers:
+                self._update_one(raw_customer)
+
+    def finish_sync(self) -> None:
+        # Only a complete sync moves the watermark, or a failed one would skip the pages it never got to
+        with self._lock:
+            if self._sync_updated_since and (not self._updated_since or self._sync_updated_since > self._updated_since):
+                self._updated_since = self._sync_updated_since
+            self._sync_updated_since = None
+            self._synced_at = self.clock()
+
+    def get_by_id(self, customer_id: str) -> Optional[Customer]:
+        with self._lock:
+            return self._by_id.get(customer_id)
+
+    def get_by_username(self, username: str) -> Optional[Customer]:
+        with self._lock:
+            customer_id = self._ids_by_username.get(username)
+            return self._by_id.get(customer_id) if customer_id else None
+
+    def is_known_missing(self, username: str) -> bool:
+        return username in self._misses
+
+    def remember_missing(self, username: str) -> None:
+        self._misses.set(username, True)
+
+    def _update_one(self, raw_customer: dict) -> None:
+        customer_id = raw_customer.get('id')
+        if not customer_id:
+            return
+
+        # Forget where the customer used to be, in case the username has changed or the customer was deleted
+        old = self._by_id.pop(customer_id, None)
+        if old and self._ids_by_username.get(old.username) == customer_id:
+            del self._ids_by_username[old.username]
+
+        updated_at = raw_customer.get('updated_at')
+        if updated_at and (not self._sync_updated_since or updated_at > self._sync_updated_since):
+            self._sync_updated_since = updated_at
+
+        customer = Customer.from_json(raw_customer)
+        if not customer or raw_customer.get('deleted_at'):
+            return
+
+        self._by_id[customer_id] = customer
+        # When more customers have the same username, the first one wins, just like when we searched the whole list
+        self._ids_by_username.setdefault(customer.username, customer_id)
+        self._misses.pop(customer.username)
@@ -4,3 +4,7 @@ class InsufficientFundsError(Exception):
 
 class InvalidCustomerError(Exception):
     pass
+
+
+class LoyverseApiError(Exception):
+    pass
@@ -0,0 +1,292 @@
+import itertools
+import json
+import logging
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+# A local stand-in for the part of the Loyverse API that we use, so the Loyverse clients can run without the network
+# It serves the customers and the receipts over real HTTP, with cursor pagination and the same filters as Loyverse,
+# and it can simulate the latency of the real API and its failures, so the bot can be benchmarked on a laptop
+class FakeLoyverseServer:
+    def __init__(self, customers: list[dict] = None, receipts: list[dict] = None, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, failure_status: int = 503, seed: int = None, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.calls: Counter[str] = Counter()
+
+        self._random = random.Random(seed)
+        self._failures: list[int] = []
+        self._lock = threading.Lock()
+
+        self.customers: dict[str, dict] = {customer['id']: customer for customer in customers or []}
+        self.receipts: list[dict] = sorted(receipts or [], key=lambda receipt: receipt['created_at'])
+
+        # Like on a till, the receipt numbers simply go up, starting after the ones we already have
+        self._receipt_numbers = itertools.count(max([FakeLoyverseServer._receipt_index(receipt) for receipt in self.receipts], default=0) + 1)
+
+        self._server = ThreadingHTTPServer((host, port), FakeLoyverseHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def synthetic(customers: int = 2000, months: int = 3, receipts_per_day: int = 150, seed: int = None, until: datetime = None, **kwargs) -> 'FakeLoyverseServer':
+        # Made-up data of roughly the same shape and size as the real thing; a few customers are regulars,
+        # most only come by once in a while, and half the receipts belong to nobody in particular
+        # The same seed and the same end date always give the same data
+        generator = random.Random(seed)
+        until = until or datetime.now(timezone.utc)
+
+        raw_customers = [FakeLoyverseServer.make_customer(f'user{i}', f'Customer {i}', generator.randint(0, 500), until - timedelta(days=generator.randint(30, 700)), FakeLoyverseServer._make_id(generator)) for i in range(customers)]
+        regulars = raw_customers[:max(1, customers // 20)]
+
+        sales = []
+        for day in range(months * 30):
+            for _ in range(receipts_per_day):
+                dice = generator.random()
+                customer = generator.choice(regulars) if dice < 0.2 else generator.choice(raw_customers) if dice < 0.5 else None
+                sales.append((until - timedelta(days=day, seconds=generator.randint(0, 86399)), customer['id'] if customer else None))
+
+        # The receipts are numbered in the order of the sales
+        sales.sort(key=lambda sale: sale[0])
+        raw_receipts = [FakeLoyverseServer.make_receipt(customer_id, number, created_at) for number, (created_at, customer_id) in enumerate(sales, start=1)]
+
+        return FakeLoyverseServer(raw_customers, raw_receipts, seed=seed, **kwargs)
+
+    @staticmethod
+    def make_customer(username: str, name: str = None, points: float = 0, created_at: datetime = None, customer_id: str = None) -> dict:
+        timestamp = FakeLoyverseServer._format_time(created_at or datetime.now(timezone.utc))
+        return {
+            'id': customer_id or str(uuid.uuid4()),
+            'name': name or username,
+            'note': username,
+            'total_points': points,
+            'created_at': timestamp,
+            'updated_at': timestamp,
+            'deleted_at': None,
+        }
+
+    @staticmethod
+    def make_receipt(customer_id: Optional[str], number: int, created_at: datetime = None) -> dict:
+        timestamp = FakeLoyverseServer._format_time(created_at or datetime.now(timezone.utc))
+        return {
+            'receipt_number': f'1-{number}',
+            'receipt_type': 'SALE',
+            'created_at': timestamp,
+            'receipt_date': timestamp,
+            'updated_at': timestamp,
+            'source': 'point of sale',
+            'total_money': 25.0,
+            'total_tax': 0.0,
+            'points_earned': 0.0,
+            'points_deducted': 0.0,
+            'points_balance': 0.0,
+            'total_discount': 0.0,
+            'employee_id': 'fake-employee',
+            'store_id': 'fake-store',
+            'pos_device_id': 'fake-pos',
+            'customer_id': customer_id,
+        }
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1.0'
+
+    def start(self) -> 'FakeLoyverseServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='FakeLoyverseServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread:
+            self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeLoyverseServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def fail_next(self, count: int = 1, status_code: int = None) -> None:
+        # The next calls fail for sure, regardless of the failure rate
+        with self._lock:
+            self._failures += [status_code or self.failure_status] * count
+
+    def add_receipt(self, customer_id: Optional[str], created_at: datetime = None) -> dict:
+        # Simulates a sale at the bar
+        with self._lock:
+            receipt = FakeLoyverseServer.make_receipt(customer_id, next(self._receipt_numbers), created_at)
+            self.receipts.append(receipt)
+            self.receipts.sort(key=lambda item: item['created_at'])
+        return receipt
+
+    def simulate(self, operation: str) -> Optional[int]:
+        # Every call costs a round trip, and it may fail just like the real thing
+        with self._lock:
+            self.calls[operation] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if self._failures:
+                failure = self._failures.pop(0)
+            elif self.failure_rate and self._random.random() < self.failure_rate:
+                failure = self.failure_status
+            else:
+                failure = None
+
+        if delay:
+            time.sleep(delay)
+        return failure
+
+    def list_customers(self, params: dict[str, str]) -> dict:
+        updated_at_min = FakeLoyverseServer._parse_time(params.get('updated_at_min'))
+        with self._lock:
+            customers = [customer for customer in self.customers.values() if not updated_at_min or FakeLoyverseServer._parse_time(customer['updated_at']) >= updated_at_min]
+        return FakeLoyverseServer._page('customers', customers, params)
+
+    def get_customer(self, customer_id: str) -> Optional[dict]:
+        with self._lock:
+            customer = self.customers.get(customer_id)
+            return dict(customer) if customer and not customer.get('deleted_at') else None
+
+    def save_customer(self, data: dict) -> dict:
+        # Just like Loyverse, a customer with an id is updated, and one without an id is created
+        with self._lock:
+            customer_id = data.get('id') or FakeLoyverseServer._make_id(self._random)
+            timestamp = FakeLoyverseServer._format_time(datetime.now(timezone.utc))
+            customer = self.customers.get(customer_id, {'created_at': timestamp, 'deleted_at': None})
+            customer.update({key: value for key, value in data.items() if value is not None})
+            customer.update({'id': customer_id, 'updated_at': timestamp})
+            self.customers[customer_id] = customer
+            return dict(customer)
+
+    def get_receipt(self, receipt_number: str) -> Optional[dict]:
+        with self._lock:
+            return next((dict(receipt) for receipt in self.receipts if receipt['receipt_number'] == receipt_number), None)
+
+    def list_receipts(self, params: dict[str, str]) -> dict:
+        created_at_min = FakeLoyverseServer._parse_time(params.get('created_at_min'))
+        with self._lock:
+            receipts = [receipt for receipt in self.receipts if not created_at_min or FakeLoyverseServer._parse_time(receipt['created_at']) >= created_at_min]
+        return FakeLoyverseServer._page('receipts', receipts, params)
+
+    @staticmethod
+    def _page(name: str, items: list[dict], params: dict[str, str]) -> dict:
+        # The cursor is simply where the next page starts; the clients treat it as an opaque string anyway
+        limit = min(int(params.get('limit', 50)), 250)
+        start = int(params.get('cursor') or 0)
+        page = items[start:start + limit]
+        cursor = str(start + limit) if start + limit < len(items) else None
+        return {name: page, 'cursor': cursor}
+
+    @staticmethod
+    def _make_id(generator: random.Random) -> str:
+        # A valid uuid that still only depends on the seed
+        return str(uuid.UUID(int=generator.getrandbits(128), version=4))
+
+    @staticmethod
+    def _receipt_index(receipt: dict) -> int:
+        try:
+            return int(receipt['receipt_number'].rsplit('-', 1)[-1])
+        except (KeyError, ValueError):
+            return 0
+
+    @staticmethod
+    def _parse_time(value: Optional[str]) -> Optional[datetime]:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+    @staticmethod
+    def _format_time(value: datetime) -> str:
+        return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class FakeLoyverseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self) -> None:
+        super().setup()
+        # The responses are small, so don't let them wait for the acknowledgement of the previous packet
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @property
+    def fake(self) -> FakeLoyverseServer:
+        return self.server.fake
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.rstrip('/').split('/')
+
+        if url.path.endswith('/customers'):
+            self._respond('get_customers', lambda: self.fake.list_customers(params))
+        elif len(parts) >= 2 and parts[-2] == 'customers':
+            self._respond('get_customer', lambda: self.fake.get_customer(parts[-1]))
+        elif url.path.endswith('/receipts'):
+            self._respond('get_receipts', lambda: self.fake.list_receipts(params))
+        elif len(parts) >= 2 and parts[-2] == 'receipts':
+            self._respond('get_receipt', lambda: self.fake.get_receipt(unquote(parts[-1])))
+        else:
+            self._send(404, {'errors': [{'code': 'NOT_FOUND'}]})
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not urlparse(self.path).path.endswith('/customers'):
+            self._send(404, {'errors': [{'code': 'NOT_FOUND'}]})
+            return
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            self._send(400, {'errors': [{'code': 'BAD_REQUEST'}]})
+            return
+
+        self._respond('save_customer', lambda: self.fake.save_customer(data))
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+    def _respond(self, operation: str, handler) -> None:
+        failure = self.fake.simulate(operation)
+        if failure:
+            self._send(failure, {'errors': [{'code': 'SIMULATED'}]}, {'Retry-After': '1'} if failure == 429 else {})
+            return
+
+        result = handler()
+        if result is None:
+            self._send(404, {'errors': [{'code': 'NOT_FOUND'}]})
+        else:
+            self._send(200, result)
+
+    def _send(self, status: int, data: dict, headers: dict[str, str] = None) -> None:
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    # Serve some made-up data until stopped, so the bot can be pointed at it with loyverse_base_url
+    logging.basicConfig(level=logging.INFO)
+    server = FakeLoyverseServer.synthetic(seed=5, port=8095, latency=0.1, jitter=0.1)
+    logger.info(f"Serving {len(server.customers)} customers and {len(server.receipts)} receipts at {server.url}")
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
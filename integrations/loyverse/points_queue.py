@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+import pytz
+
+from helpers.points import Points
+from helpers.metrics import Metrics
+
+from data.models.user import User
+
+logger = logging.getLogger(__name__)
+
+Apply = Callable[[User, Points], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class PointsAdjustment:
+    user: User
+    points: Points
+    reason: str
+    queued_at: datetime
+
+
+# Collects the points awarded to the customers and writes them to Loyverse in the background
+# All the points a customer receives within the window are added up and saved with a single read-modify-write,
+# but the audit trail still gets one record for every adjustment, so we can always tell where the points came from
+# Without a path the audit records only go to the log
+class PointsAdjustmentQueue:
+    def __init__(self, apply: Apply, window: float = 1.0, audit_path: Optional[str] = None, metrics: Metrics = None):
+        self.apply = apply
+        self.window = window
+        self.audit_path = audit_path
+        self.metrics = metrics or Metrics()
+
+        self._pending: dict[User, list[tuple[PointsAdjustment, asyncio.Future]]] = {}
+        self._timers: dict[User, asyncio.Task] = {}
+
+        if audit_path and os.path.dirname(audit_path):
+            os.makedirs(os.path.dirname(audit_path), exist_ok=True)
+
+    def add(self, user: User, points: Points, reason: str) -> asyncio.Future:
+        # The future completes once the points are in Loyverse, or fails if they could not be saved
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        adjustment = PointsAdjustment(user, points, reason, datetime.now(pytz.utc))
+        self._pending.setdefault(user, []).append((adjustment, future))
+        self.metrics.increment('loyverse.points_adjustments')
+
+        if user not in self._timers:
+            self._timers[user] = loop.create_task(self._flush_later(user))
+
+        return future
+
+    async def close(self) -> None:
+        # Anything still pending is written immediately, without waiting for the window to close
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+
+        for user in list(self._pending.keys()):
+            await self._flush(user)
+
+    async def _flush_later(self, user: User) -> None:
+        await asyncio.sleep(self.window)
+        self._timers.pop(user, None)
+        await self._flush(user)
+
+    async def _flush(self, user: User) -> None:
+        batch = self._pending.pop(user, [])
+        if not batch:
+            return
+
+        total = sum((adjustment.points for adjustment, _ in batch), start=Points(0))
+        batch_id = uuid.uuid4().hex
+        self.metrics.increment('loyverse.points_writes')
+
+        try:
+            await self.apply(user, total)
+        except Exception as error:
+            logger.error(f"Could not add {total} points to {user.full_name}: {error}")
+            self._audit(batch_id, batch, 'failed')
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        self._audit(batch_id, batch, 'applied')
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    def _audit(self, batch_id: str, batch: list[tuple[PointsAdjustment, asyncio.Future]], status: str) -> None:
+        records = [{
+            'batch': batch_id,
+            'status': status,
+            'user': adjustment.user.full_name,
+            'points': str(adjustment.points),
+            'reason': adjustment.reason,
+            'queued_at': adjustment.queued_at.isoformat(),
+        } for adjustment, _ in batch]
+
+        for record in records:
+            logger.info(f"Points adjustment {record}")
+
+        if not self.audit_path:
+            return
+
+        try:
+            with open(self.audit_path, 'a', encoding='utf-8') as file:
+                for record in records:
+                    file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        except OSError as error:
+            logger.error(f"Could not write the points audit to {self.audit_path}: {error}")
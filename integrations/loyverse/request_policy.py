@@ -0,0 +1,47 @@
+import random
+import time
+from typing import Callable, Optional
+
+
+# The rules for calling Loyverse: how fast we may call it, and which failed calls are worth repeating
+# Loyverse limits the number of calls per access token, so the calls are spaced out with a token bucket,
+# and the calls that were throttled or failed on the Loyverse side are retried with exponential backoff
+class LoyverseRequestPolicy:
+    RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, requests_per_minute: int = 60, max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.capacity = requests_per_minute
+        self.rate = requests_per_minute / 60  # Tokens per second
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+
+        self._tokens = float(requests_per_minute)
+        self._updated_at = clock()
+
+    def reserve(self) -> float:
+        # Takes a token and tells the caller how long to wait before using it; the caller does the waiting
+        # Only the coroutines on the event loop call this, and it never awaits anything, so it doesn't need a lock
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def should_retry(self, status_code: Optional[int], attempt: int) -> bool:
+        # Without a status code, the call didn't get an answer at all, e.g. because it timed out
+        retryable = status_code is None or status_code in LoyverseRequestPolicy.RETRYABLE_STATUS_CODES
+        return retryable and attempt < self.max_retries
+
+    def retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        # When Loyverse tells us how long to wait, we listen
+        if retry_after:
+            try:
+                return min(self.max_delay, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+
+        # Exponential backoff with full jitter, so concurrent callers don't retry in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
@@ -0,0 +1,106 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+ReceiptsHandler = Callable[[list[str]], None]
+
+
+# Receives the receipts that Loyverse pushes to us through its webhooks, as soon as a sale is made
+# Loyverse doesn't sign the calls, so the secret at the end of the path is the only thing that keeps strangers out
+# Even so, only the receipt numbers are handed over, and the receipts themselves are loaded from Loyverse before they
+# count for anything; every number costs a call to Loyverse, so the size of the calls is limited as well
+# The handler must return quickly, because Loyverse doesn't wait for long, so it only schedules the actual work
+class LoyverseWebhookReceiver:
+    MIN_SECRET_LENGTH = 16
+
+    def __init__(self, path: str, secret: str, host: str = '0.0.0.0', port: int = 8080, max_body_size: int = 64 * 1024, max_receipts: int = 50):
+        if not secret or len(secret) < LoyverseWebhookReceiver.MIN_SECRET_LENGTH or '/' in secret:
+            raise ValueError(f"The Loyverse webhook needs a secret of at least {LoyverseWebhookReceiver.MIN_SECRET_LENGTH} characters, without slashes")
+
+        self.path = '/' + '/'.join(part for part in [path.strip('/'), secret] if part)
+        self.max_body_size = max_body_size
+        self.max_receipts = max_receipts
+        self.handler: Optional[ReceiptsHandler] = None
+
+        self._server = ThreadingHTTPServer((host, port), LoyverseWebhookHandler)
+        self._server.daemon_threads = True
+        self._server.receiver = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self, handler: ReceiptsHandler) -> None:
+        self.handler = handler
+        self._thread = threading.Thread(target=self._server.serve_forever, name='LoyverseWebhookReceiver', daemon=True)
+        self._thread.start()
+        logger.info(f"Listening for Loyverse webhooks on port {self.port}")
+
+    def stop(self) -> None:
+        if self._thread:
+            self._server.shutdown()
+        self._server.server_close()
+
+
+class LoyverseWebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def receiver(self) -> LoyverseWebhookReceiver:
+        return self.server.receiver
+
+    def do_POST(self) -> None:
+        # The calls we don't want are turned away before we read them, and the connection is closed,
+        # because the body that we didn't read is still on it
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > self.receiver.max_body_size:
+            self.close_connection = True
+            self._send(413)
+            return
+
+        if urlparse(self.path).path.rstrip('/') != self.receiver.path or not self.receiver.handler:
+            self.close_connection = True
+            self._send(404)
+            return
+
+        body = self.rfile.read(length)
+        try:
+            data = json.loads(body)
+            receipt_numbers = [str(receipt['receipt_number']) for receipt in data.get('receipts', [])]
+        except (ValueError, AttributeError, KeyError, TypeError):
+            logger.warning(f"Ignoring a Loyverse webhook that is not valid: {body[:200]}")
+            self._send(400)
+            return
+
+        if len(receipt_numbers) > self.receiver.max_receipts:
+            logger.warning(f"Ignoring a Loyverse webhook with {len(receipt_numbers)} receipts")
+            self._send(413)
+            return
+
+        try:
+            self.receiver.handler(receipt_numbers)
+        except Exception as e:
+            # The receipts could not even be handed over, so Loyverse should send them again
+            # Failures while processing them happen later and are not reported here; the reconciliation poll catches those
+            logger.exception(e)
+            self._send(500)
+            return
+
+        self._send(200)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+    def _send(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
@@ -0,0 +1,111 @@
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    full_name TEXT PRIMARY KEY,
+    aliases TEXT NOT NULL DEFAULT '',
+    role TEXT NOT NULL,
+    telegram_username TEXT NOT NULL DEFAULT '',
+    birthday TEXT,
+    telegram_id INTEGER,
+    loyverse_id TEXT,
+    last_private_chat TEXT,
+    last_visit TEXT,
+    recent_visits INTEGER NOT NULL DEFAULT 0,
+    unmirrored INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS users_by_telegram_id ON users (telegram_id);
+CREATE INDEX IF NOT EXISTS users_by_telegram_username ON users (telegram_username);
+CREATE INDEX IF NOT EXISTS users_by_birthday ON users (birthday);
+CREATE INDEX IF NOT EXISTS users_by_loyverse_id ON users (loyverse_id);
+
+CREATE TABLE IF NOT EXISTS user_search (
+    key TEXT NOT NULL,
+    full_name TEXT NOT NULL REFERENCES users (full_name) ON DELETE CASCADE,
+    PRIMARY KEY (key, full_name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_search_by_full_name ON user_search (full_name);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    day TEXT NOT NULL,
+    host TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS events_by_day ON events (day, start_date);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    weekday INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_done INTEGER NOT NULL DEFAULT 0,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (weekday, time, name)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_position ON tasks (weekday, position);
+
+CREATE TABLE IF NOT EXISTS raffle_entries (
+    id INTEGER PRIMARY KEY,
+    full_name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    country TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS raffle_entries_by_full_name ON raffle_entries (full_name, id);
+'''
+
+
+# A local database for the repositories, which doesn't depend on the network and is much faster than a spreadsheet
+# Every thread gets its own connection; in WAL mode the readers never wait for a writer, and the other way around
+class SqliteDatabase:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection().executescript(SCHEMA)
+        logger.info(f"Opened the SQLite database at {path}")
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection:
+            return connection
+
+        # The transactions are managed by hand, so the connection runs in autocommit mode
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')  # Safe in WAL mode, and much faster
+        connection.execute('PRAGMA busy_timeout=5000')  # Wait for the other writers instead of failing
+        connection.execute('PRAGMA foreign_keys=ON')
+
+        self._local.connection = connection
+        return connection
+
+    def query(self, sql: str, parameters: tuple = ()) -> list[sqlite3.Row]:
+        return self.connection().execute(sql, parameters).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        # Everything in the transaction is saved together, or not at all
+        # The write lock is taken right away, so two writers never deadlock while upgrading their locks
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
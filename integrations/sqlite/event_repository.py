@@ -0,0 +1,64 @@
+import sqlite3
+import pytz
+
+from datetime import date, datetime
+from typing import Optional, Union
+
+from data.repositories.event import EventRepository
+from data.models.event import Event
+
+from integrations.sqlite.database import SqliteDatabase
+
+
+class SqliteEventRepository(EventRepository):
+    def __init__(self, database: SqliteDatabase, timezone: pytz.timezone = None, mirror: EventRepository = None):
+        self.timezone = timezone
+        self.database = database
+
+        # The events can only be edited in the mirror, e.g. the Google sheet
+        self.mirror = mirror
+
+    def get_all_events(self) -> list[Event]:
+        records = self.database.query('SELECT * FROM events ORDER BY start_date, id')
+        return [self._from_record(record) for record in records]
+
+    def get_events_on(self, on_date: Union[date, datetime]) -> list[Event]:
+        real_date = on_date if type(on_date) is date else on_date.date()
+        records = self.database.query('SELECT * FROM events WHERE day = ? ORDER BY start_date, id', (real_date.isoformat(),))
+        return [self._from_record(record) for record in records]
+
+    def import_from_mirror(self) -> None:
+        # The events are only edited in the mirror, so we simply take over all of them
+        events = self.mirror.get_all_events()
+        with self.database.transaction() as connection:
+            connection.execute('DELETE FROM events')
+            connection.executemany(
+                'INSERT INTO events (name, start_date, end_date, day, host, description) VALUES (?, ?, ?, ?, ?, ?)',
+                [tuple(SqliteEventRepository._to_record(event).values()) for event in events],
+            )
+
+    def _from_record(self, record: sqlite3.Row) -> Event:
+        return Event(
+            name=record['name'],
+            start_date=self._parse_datetime(record['start_date']),
+            end_date=self._parse_datetime(record['end_date']),
+            host=record['host'],
+            description=record['description'],
+        )
+
+    @staticmethod
+    def _to_record(event: Event) -> dict:
+        return {
+            'name': event.name,
+            'start_date': event.start_date.strftime('%Y-%m-%d %H:%M:%S'),
+            'end_date': event.end_date.strftime('%Y-%m-%d %H:%M:%S'),
+            'day': event.start_date.date().isoformat(),
+            'host': event.host,
+            'description': event.description,
+        }
+
+    def _parse_datetime(self, datetime_string: str) -> Optional[datetime]:
+        try:
+            return self.timezone.localize(datetime.strptime(datetime_string, '%Y-%m-%d %H:%M:%S'))
+        except ValueError:
+            return None
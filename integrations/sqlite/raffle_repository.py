@@ -0,0 +1,98 @@
+import sqlite3
+import pytz
+import random
+
+from typing import Optional
+from collections import Counter
+from itertools import groupby
+from datetime import datetime
+
+from data.repositories.raffle import RaffleRepository
+from data.models.user import User
+from data.models.raffle_entry import RaffleEntry, countries
+
+from integrations.sqlite.database import SqliteDatabase
+
+
+class SqliteRaffleRepository(RaffleRepository):
+    def __init__(self, database: SqliteDatabase, timezone: pytz.timezone = None, mirror: RaffleRepository = None):
+        self.timezone = timezone
+        self.database = database
+
+        # The new entries are also added to the mirror, e.g. the Google sheet, so people can see them
+        self.mirror = mirror
+
+    def get_by_user(self, user: User) -> list[RaffleEntry]:
+        records = self.database.query('SELECT * FROM raffle_entries WHERE full_name = ? ORDER BY id', (user.full_name,))
+        return [self._from_record(record) for record in records]
+
+    def count_by_user(self, user: User) -> int:
+        return self.database.query('SELECT COUNT(*) FROM raffle_entries WHERE full_name = ?', (user.full_name,))[0][0]
+
+    def list_by_user(self) -> dict[str, list[RaffleEntry]]:
+        records = self.database.query('SELECT * FROM raffle_entries ORDER BY full_name, id')
+        entries = [self._from_record(record) for record in records]
+        return {key: list(group) for key, group in groupby(entries, key=lambda entry: entry.full_name)}
+
+    def create(self, user: User) -> RaffleEntry:
+        entry = RaffleEntry(
+            full_name=user.full_name,
+            created_at=datetime.now(tz=self.timezone),
+            country=random.choice(countries)
+        )
+
+        with self.database.transaction() as connection:
+            SqliteRaffleRepository._insert(connection, [entry])
+
+        if self.mirror:
+            self.mirror.add(entry)
+
+        return entry
+
+    def close(self) -> None:
+        # Make sure that all the new entries reach the mirror
+        if self.mirror:
+            self.mirror.close()
+
+    def import_from_mirror(self) -> None:
+        # The entries are never edited, so we only take over the ones we don't have yet
+        # The same entry can legitimately appear more than once, so we compare how many of each there are
+        entries = [entry for entries in self.mirror.list_by_user().values() for entry in entries]
+        with self.database.transaction() as connection:
+            records = connection.execute('SELECT full_name, created_at, country FROM raffle_entries').fetchall()
+            existing = Counter(tuple(record) for record in records)
+
+            missing = []
+            for entry in entries:
+                values = SqliteRaffleRepository._to_values(entry)
+                if existing[values] > 0:
+                    existing[values] -= 1
+                else:
+                    missing.append(entry)
+
+            SqliteRaffleRepository._insert(connection, missing)
+
+    @staticmethod
+    def _insert(connection: sqlite3.Connection, entries: list[RaffleEntry]) -> None:
+        # Every entry gets its own row, even when it looks just like another one
+        connection.executemany(
+            'INSERT INTO raffle_entries (full_name, created_at, country) VALUES (?, ?, ?)',
+            [SqliteRaffleRepository._to_values(entry) for entry in entries],
+        )
+
+    @staticmethod
+    def _to_values(entry: RaffleEntry) -> tuple[str, str, str]:
+        return entry.full_name, entry.created_at.strftime('%Y-%m-%d %H:%M:%S') if entry.created_at else '', entry.country
+
+    def _from_record(self, record: sqlite3.Row) -> RaffleEntry:
+        return RaffleEntry(
+            full_name=record['full_name'],
+            created_at=self._parse_datetime(record['created_at']),
+            country=record['country'],
+        )
+
+    def _parse_datetime(self, datetime_string: str) -> Optional[datetime]:
+        try:
+            return self.timezone.localize(datetime.strptime(datetime_string, '%Y-%m-%d %H:%M:%S'))
+        except ValueError:
+            return None
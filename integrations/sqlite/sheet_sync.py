@@ -0,0 +1,61 @@
+import logging
+from typing import Callable, Optional
+
+from integrations.google.sheet_changes import SheetChanges
+from integrations.google.sheet_database import GoogleSheetDatabase
+from integrations.sqlite.user_repository import SqliteUserRepository
+from integrations.sqlite.event_repository import SqliteEventRepository
+from integrations.sqlite.task_repository import SqliteTaskRepository
+from integrations.sqlite.raffle_repository import SqliteRaffleRepository
+
+logger = logging.getLogger(__name__)
+
+
+# Keeps the Google sheet as a human-editable mirror of the SQLite data
+# The local changes reach the sheet through the mirror repositories, and the edits made in the sheet come back from here
+# The mirror repositories must subscribe to the database before this does, so they are up-to-date when we import from them
+class GoogleSheetSync:
+    def __init__(self, database: GoogleSheetDatabase, users: SqliteUserRepository, events: SqliteEventRepository, tasks: SqliteTaskRepository, raffle: SqliteRaffleRepository):
+        self.users = users
+        self._first_users = True
+        self._full_names: Optional[set[str]] = None
+
+        database.users.subscribe(self._remember_full_names)
+        database.user_changes.subscribe(self._import_users)
+        database.live.subscribe(self._remove_missing_users)
+        database.events.subscribe(lambda rows: GoogleSheetSync._import_all(rows, events.import_from_mirror, 'events'))
+        database.tasks.subscribe(lambda rows: GoogleSheetSync._import_all(rows, tasks.import_from_mirror, 'tasks'))
+        database.raffle.subscribe(lambda rows: GoogleSheetSync._import_all(rows, raffle.import_from_mirror, 'raffle entries'))
+
+    def _import_users(self, changes: SheetChanges) -> None:
+        # The first changes contain the whole sheet, which may come from an old snapshot, so our own newer changes win
+        # After that, the changes are edits made in the sheet since the previous refresh
+        keep_local = self._first_users
+        self._first_users = False
+
+        full_names = [row.get('full_name', '').strip() for row in changes.added + changes.modified]
+        removed = [row.get('full_name', '').strip() for row in changes.removed]
+        GoogleSheetSync._import(lambda: self.users.import_from_mirror(full_names, removed, keep_local), 'users')
+
+    def _remember_full_names(self, rows: list[dict]) -> None:
+        full_names = {row.get('full_name', '').strip() for row in rows} - {''}
+        self._full_names = full_names or None
+
+    def _remove_missing_users(self, live: bool) -> None:
+        # The users that are missing from the sheet were removed from it, but only the live sheet can tell
+        if live and self._full_names:
+            GoogleSheetSync._import(lambda: self.users.remove_missing(self._full_names), 'removed users')
+
+    @staticmethod
+    def _import_all(rows: list, action: Callable[[], None], name: str) -> None:
+        # No rows means that we didn't get any data yet, so we keep what we have
+        if rows:
+            GoogleSheetSync._import(action, name)
+
+    @staticmethod
+    def _import(action: Callable[[], None], name: str) -> None:
+        try:
+            action()
+            logger.info(f"Imported the {name} from the Google sheet")
+        except Exception as e:
+            logger.exception(e)
@@ -0,0 +1,65 @@
+import sqlite3
+import pytz
+
+from datetime import datetime, time
+
+from data.repositories.task import TaskRepository
+from data.models.task import Task
+
+from integrations.sqlite.database import SqliteDatabase
+
+
+class SqliteTaskRepository(TaskRepository):
+    def __init__(self, database: SqliteDatabase, timezone: pytz.timezone = None, mirror: TaskRepository = None):
+        self.timezone = timezone
+        self.database = database
+
+        # The changes are also saved to the mirror, e.g. the Google sheet, where people can edit them by hand
+        self.mirror = mirror
+
+    def get_all_tasks(self) -> list[Task]:
+        records = self.database.query('SELECT * FROM tasks ORDER BY weekday, position')
+        return [SqliteTaskRepository._from_record(record) for record in records]
+
+    def get_tasks_between(self, start: datetime, end: datetime) -> list[Task]:
+        records = self.database.query(
+            'SELECT * FROM tasks WHERE weekday = ? AND time >= ? AND time < ? ORDER BY position',
+            (start.weekday(), start.time().strftime('%H:%M:%S'), end.time().strftime('%H:%M:%S')),
+        )
+        return [SqliteTaskRepository._from_record(record) for record in records]
+
+    def toggle(self, task: Task) -> Task:
+        new_task = task.copy(is_done=not task.is_done)
+
+        # Only existing tasks can be toggled
+        key = (task.weekday, task.time.strftime('%H:%M:%S'), task.name)
+        if not self.database.query('SELECT 1 FROM tasks WHERE weekday = ? AND time = ? AND name = ?', key):
+            return new_task
+
+        # The checklist is imported from the mirror, so it goes first; if it can't be saved there, nothing changes
+        if self.mirror:
+            self.mirror.toggle(task)
+
+        with self.database.transaction() as connection:
+            connection.execute('UPDATE tasks SET is_done = ? WHERE weekday = ? AND time = ? AND name = ?', (int(new_task.is_done),) + key)
+
+        return new_task
+
+    def import_from_mirror(self) -> None:
+        # The checklist is edited in the mirror, so we simply take over all the tasks, in their order
+        tasks = self.mirror.get_all_tasks()
+        with self.database.transaction() as connection:
+            connection.execute('DELETE FROM tasks')
+            connection.executemany(
+                'INSERT OR REPLACE INTO tasks (weekday, time, name, is_done, position) VALUES (?, ?, ?, ?, ?)',
+                [(task.weekday, task.time.strftime('%H:%M:%S'), task.name, int(task.is_done), i) for i, task in enumerate(tasks)],
+            )
+
+    @staticmethod
+    def _from_record(record: sqlite3.Row) -> Task:
+        return Task(
+            weekday=record['weekday'],
+            time=time.fromisoformat(record['time']),
+            name=record['name'],
+            is_done=bool(record['is_done']),
+        )
@@ -0,0 +1,221 @@
+import logging
+import sqlite3
+import pytz
+
+from typing import Optional, Union
+from datetime import date, datetime
+
+from data.repositories.user import UserRepository
+from data.models.user import User
+from data.models.user_role import UserRole
+
+from integrations.sqlite.database import SqliteDatabase
+
+logger = logging.getLogger(__name__)
+
+USER_COLUMNS = [
+    'full_name',
+    'aliases',
+    'role',
+    'telegram_username',
+    'birthday',
+    'telegram_id',
+    'loyverse_id',
+    'last_private_chat',
+    'last_visit',
+    'recent_visits',
+]
+
+
+class SqliteUserRepository(UserRepository):
+    def __init__(self, database: SqliteDatabase, timezone: pytz.timezone = None, mirror: UserRepository = None):
+        self.timezone = timezone
+        self.database = database
+
+        # The changes are also saved to the mirror, e.g. the Google sheet, where people can edit them by hand
+        self.mirror = mirror
+
+    def get_by_full_name(self, full_name: str) -> Optional[User]:
+        return self._get_one('full_name', full_name)
+
+    def get_by_telegram_id(self, telegram_id: int) -> Optional[User]:
+        return self._get_one('telegram_id', telegram_id)
+
+    def get_by_telegram_name(self, telegram_name: str) -> Optional[User]:
+        return self._get_one('telegram_username', telegram_name) if telegram_name else None
+
+    def get_by_birthday(self, birthday: Union[str, date, datetime]) -> list[User]:
+        date_string = birthday if isinstance(birthday, str) else birthday.strftime('%m-%d')
+        records = self.database.query('SELECT * FROM users WHERE birthday = ? ORDER BY rowid', (date_string,))
+        return [self._from_record(record) for record in records]
+
+    def get_by_loyverse_id(self, loyverse_id: str) -> Optional[User]:
+        return self._get_one('loyverse_id', loyverse_id) if loyverse_id else None
+
+    def search(self, query: str) -> set[User]:
+        query = query.lower()
+
+        # A direct match is a successful prefix search; this is usually what we want
+        # E.g. The entry for Alex will match Alex Uzan, Alexandru Ivanciu, and Alexandra Tudor
+        if self.database.query('SELECT 1 FROM user_search WHERE key = ? LIMIT 1', (query,)):
+            # The upper bound is the query followed by the highest possible character, so the primary key is used
+            records = self.database.query(
+                'SELECT DISTINCT users.* FROM user_search JOIN users USING (full_name) WHERE key >= ? AND key < ?',
+                (query, query + '\U0010ffff'),
+            )
+            return {self._from_record(record) for record in records}
+
+        # No direct matches -> do a full search
+        records = self.database.query(
+            'SELECT DISTINCT users.* FROM user_search JOIN users USING (full_name) WHERE instr(key, ?) > 0',
+            (query,),
+        )
+        return {self._from_record(record) for record in records}
+
+    def save(self, user: User) -> None:
+        self.save_all([user])
+
+    def save_all(self, users: list[User]) -> None:
+        if not users:
+            return
+
+        with self.database.transaction() as connection:
+            changed: list[User] = []
+            for user in users:
+                # Only existing users are saved
+                record = connection.execute('SELECT * FROM users WHERE full_name = ?', (user.full_name,)).fetchone()
+                if not record:
+                    continue
+
+                # Only users with data changes will be saved
+                diff = SqliteUserRepository._diff(dict(record), SqliteUserRepository._to_record(user))
+                if not diff:
+                    continue
+
+                # The user is marked until the mirror catches up, so an older copy from the mirror can't overwrite the change
+                assignments = ', '.join(f'{column} = ?' for column in diff.keys())
+                connection.execute(f'UPDATE users SET {assignments}, unmirrored = 1 WHERE full_name = ?', (*diff.values(), user.full_name))
+                SqliteUserRepository._save_search_keys(connection, user)
+                changed.append(user)
+
+            # The mirror only queues the changes, so it's quick enough to update in the same transaction
+            if self.mirror and changed:
+                self.mirror.save_all(changed)
+
+    def import_from_mirror(self, full_names: list[str], removed: list[str] = None, keep_local: bool = False) -> None:
+        # Takes over the changes that were made in the mirror, without sending them back
+        # With keep_local, the mirror data may be older than ours, e.g. when it comes from a snapshot, so the users
+        # that we changed since the mirror last caught up are kept, and sent to the mirror again instead
+        # The mirror is read inside the transaction, so it can't interleave with a save
+        with self.database.transaction() as connection:
+            for full_name in removed or []:
+                connection.execute('DELETE FROM users WHERE full_name = ?', (full_name,))
+
+            users = [user for user in (self.mirror.get_by_full_name(full_name) for full_name in full_names) if user]
+            pending = self.mirror.pending_changes()
+            columns = USER_COLUMNS + ['unmirrored']
+            placeholders = ', '.join('?' for _ in columns)
+            updates = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+            local_users: list[User] = []
+            for user in users:
+                record = connection.execute('SELECT * FROM users WHERE full_name = ?', (user.full_name,)).fetchone()
+                if keep_local and record and record['unmirrored'] and SqliteUserRepository._diff(dict(record), SqliteUserRepository._to_record(user)):
+                    local_users.append(self._from_record(record))
+                    continue
+
+                # Our change only counts as mirrored once the mirror has actually written it
+                connection.execute(
+                    f'INSERT INTO users ({", ".join(columns)}) VALUES ({placeholders}) ON CONFLICT (full_name) DO UPDATE SET {updates}',
+                    (*SqliteUserRepository._to_record(user).values(), int(user.full_name in pending)),
+                )
+                SqliteUserRepository._save_search_keys(connection, user)
+
+            if local_users:
+                logger.info(f"Kept the local changes of {len(local_users)} users that had not reached the mirror")
+                self.mirror.save_all(local_users)
+
+    def remove_missing(self, full_names: set[str]) -> None:
+        # Only called with the complete, live list of users in the mirror; the others have been removed from it
+        with self.database.transaction() as connection:
+            stale = [(record['full_name'],) for record in connection.execute('SELECT full_name FROM users') if record['full_name'] not in full_names]
+            connection.executemany('DELETE FROM users WHERE full_name = ?', stale)
+
+        if stale:
+            logger.info(f"Removed {len(stale)} users that are no longer in the mirror")
+
+    def close(self) -> None:
+        # Make sure that all the changes reach the mirror
+        if self.mirror:
+            self.mirror.close()
+
+    def _get_one(self, column: str, value) -> Optional[User]:
+        if value is None:
+            return None
+
+        # When more users share a value, the last one wins, just like in the Google sheet
+        records = self.database.query(f'SELECT * FROM users WHERE {column} = ? ORDER BY rowid DESC LIMIT 1', (value,))
+        return self._from_record(records[0]) if records else None
+
+    @staticmethod
+    def _save_search_keys(connection: sqlite3.Connection, user: User) -> None:
+        connection.execute('DELETE FROM user_search WHERE full_name = ?', (user.full_name,))
+        connection.executemany(
+            'INSERT INTO user_search (key, full_name) VALUES (?, ?)',
+            [(key, user.full_name) for key in SqliteUserRepository._search_keys(user)],
+        )
+
+    @staticmethod
+    def _search_keys(user: User) -> set[str]:
+        # Complete telegram username, complete alias list, first name and complete full name
+        keys = {alias.lower() for alias in user.aliases}
+        keys.add(user.first_name.lower())
+        keys.add(user.full_name.lower())
+        if user.telegram_username:
+            keys.add(user.telegram_username.lower())
+        return keys
+
+    def _from_record(self, record: sqlite3.Row) -> User:
+        return User(
+            full_name=record['full_name'],
+            aliases=[alias for alias in record['aliases'].split(',') if alias],
+            role=SqliteUserRepository._parse_user_role(record['role']),
+            telegram_username=record['telegram_username'],
+            birthday=record['birthday'],
+            telegram_id=record['telegram_id'],
+            loyverse_id=record['loyverse_id'],
+            last_private_chat=self._parse_datetime(record['last_private_chat']),
+            last_visit=self._parse_datetime(record['last_visit']),
+            recent_visits=record['recent_visits'],
+        )
+
+    @staticmethod
+    def _to_record(user: User) -> dict:
+        return {
+            'full_name': user.full_name,
+            'aliases': ','.join(user.aliases),
+            'role': user.role.value,
+            'telegram_username': user.telegram_username or '',
+            'birthday': user.birthday,
+            'telegram_id': user.telegram_id,
+            'loyverse_id': user.loyverse_id,
+            'last_private_chat': user.last_private_chat.strftime('%Y-%m-%d %H:%M:%S') if user.last_private_chat else None,
+            'last_visit': user.last_visit.strftime('%Y-%m-%d %H:%M:%S') if user.last_visit else None,
+            'recent_visits': user.recent_visits,
+        }
+
+    @staticmethod
+    def _diff(a: dict, b: dict) -> dict:
+        return {k: v for k, v in b.items() if a[k] != v}
+
+    def _parse_datetime(self, datetime_string: Optional[str]) -> Optional[datetime]:
+        try:
+            return self.timezone.localize(datetime.strptime(datetime_string, '%Y-%m-%d %H:%M:%S'))
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse_user_role(user_role_string: str) -> UserRole:
+        try:
+            return UserRole(user_role_string)
+        except ValueError:
+            return UserRole.CHAMPION
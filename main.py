@@ -1,9 +1,10 @@
+import asyncio
 import logging
 import os
 import pytz
 import json
 
-from telegram.ext import ApplicationBuilder
+from telegram.ext import Application, ApplicationBuilder
 from dotenv import load_dotenv
 
 from helpers.access_checker import AccessChecker
@@ -12,12 +13,20 @@ from helpers.points import Points
 from helpers.raffle import Raffle
 from helpers.chat_target import ChatTarget
 
-from integrations.loyverse.api import LoyverseApi
+from integrations.loyverse.async_api import AsyncLoyverseApi
+from integrations.loyverse.webhook_receiver import LoyverseWebhookReceiver
+from integrations.google.api import GoogleApi
 from integrations.google.sheet_database import GoogleSheetDatabase
 from integrations.google.sheet_event_repository import GoogleSheetEventRepository
 from integrations.google.sheet_user_repository import GoogleSheetUserRepository
 from integrations.google.sheet_task_repository import GoogleSheetTaskRepository
 from integrations.google.sheet_raffle_repository import GoogleSheetRaffleRepository
+from integrations.sqlite.database import SqliteDatabase
+from integrations.sqlite.sheet_sync import GoogleSheetSync
+from integrations.sqlite.user_repository import SqliteUserRepository
+from integrations.sqlite.event_repository import SqliteEventRepository
+from integrations.sqlite.task_repository import SqliteTaskRepository
+from integrations.sqlite.raffle_repository import SqliteRaffleRepository
 
 from modules.help import HelpModule
 from modules.points import PointsModule
@@ -29,6 +38,7 @@ from modules.visits import VisitsModule
 from modules.tasks import TasksModule
 from modules.announcements import AnnouncementsModule
 from modules.tracking import TrackingModule
+from modules.stats import StatsModule
 
 load_dotenv()
 
@@ -41,6 +51,13 @@ class MainConfig:
         self.telegram_token = os.getenv('telegram_token')
         self.loyverse_token = os.getenv('loyverse_token')
         self.loyverse_read_only = bool(int(os.getenv('loyverse_read_only', 0)))
+        self.loyverse_timeout = float(os.getenv('loyverse_timeout', 30))
+        self.loyverse_base_url = os.getenv('loyverse_base_url') or AsyncLoyverseApi.BASE_URL
+        self.loyverse_customer_ttl = float(os.getenv('loyverse_customer_ttl', 30))
+        self.loyverse_requests_per_minute = int(os.getenv('loyverse_requests_per_minute', 60))
+        self.loyverse_max_retries = int(os.getenv('loyverse_max_retries', 4))
+        self.loyverse_points_window = float(os.getenv('loyverse_points_window', 1))
+        self.loyverse_points_audit_path = os.getenv('loyverse_points_audit_path', '.cache/points_audit.jsonl')
         self.announcement_chats = ChatTarget.parse_multi(os.getenv('announcement_chats', ''))
         self.admin_chats = ChatTarget.parse_multi(os.getenv('admin_chats', ''))
         self.tasks_chats = ChatTarget.parse_multi(os.getenv('tasks_chats', ''))
@@ -51,25 +68,64 @@ class MainConfig:
         self.point_masters = set([username for username in os.getenv('point_masters', '').split(',') if username])
         self.google_api_credentials = os.getenv('google_api_credentials')
         self.google_spreadsheet_key = os.getenv('google_spreadsheet_key')
+        self.google_write_delay = float(os.getenv('google_write_delay', 5))
+        self.google_snapshot_path = os.getenv('google_snapshot_path')
+        self.google_requests_per_minute = int(os.getenv('google_requests_per_minute', 60))
+        self.raffle_journal_path = os.getenv('raffle_journal_path', '.cache/raffle_journal.jsonl')
+        self.storage_backend = os.getenv('storage_backend', 'google')
+        self.sqlite_path = os.getenv('sqlite_path', '.cache/t5.sqlite3')
+        self.sqlite_sheet_sync = bool(int(os.getenv('sqlite_sheet_sync', 1)))
         self.xmas_loyverse_id = os.getenv('xmas_loyverse_id')
         self.visits_to_points = {int(visits): Points(points) for visits, points in json.loads(os.getenv('visits_to_points') or '{}').items()}
+        self.visits_webhook_port = int(os.getenv('visits_webhook_port') or 0)
+        self.visits_webhook_path = os.getenv('visits_webhook_path', '/loyverse/receipts')
+        self.visits_webhook_secret = os.getenv('visits_webhook_secret')
+        self.visits_reconciliation_interval = float(os.getenv('visits_reconciliation_interval', 60 * 60))
+        self.stats_log_interval = float(os.getenv('stats_log_interval', 60 * 60))
 
 
 def main() -> None:
     config = MainConfig()
     logging.basicConfig(level=config.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-    database = GoogleSheetDatabase(
-        spreadsheet_key=config.google_spreadsheet_key,
-        api_credentials=config.google_api_credentials,
+    database = event_repository = user_repository = task_repository = raffle_repository = None
+    if config.storage_backend == 'google' or config.sqlite_sheet_sync:
+        database = GoogleSheetDatabase(
+            spreadsheet_key=config.google_spreadsheet_key,
+            api=GoogleApi(config.google_api_credentials, requests_per_minute=config.google_requests_per_minute),
+            snapshot_path=config.google_snapshot_path,
+        )
+
+        event_repository = GoogleSheetEventRepository(database, config.timezone)
+        user_repository = GoogleSheetUserRepository(database, config.timezone, write_delay=config.google_write_delay)
+        task_repository = GoogleSheetTaskRepository(database, config.timezone)
+        raffle_repository = GoogleSheetRaffleRepository(database, config.timezone, write_delay=config.google_write_delay, journal_path=config.raffle_journal_path)
+
+    if config.storage_backend == 'sqlite':
+        # The Google sheet, when we have one, becomes a mirror of the local database
+        sqlite_database = SqliteDatabase(config.sqlite_path)
+        event_repository = SqliteEventRepository(sqlite_database, config.timezone, mirror=event_repository)
+        user_repository = SqliteUserRepository(sqlite_database, config.timezone, mirror=user_repository)
+        task_repository = SqliteTaskRepository(sqlite_database, config.timezone, mirror=task_repository)
+        raffle_repository = SqliteRaffleRepository(sqlite_database, config.timezone, mirror=raffle_repository)
+
+        if database:
+            GoogleSheetSync(database, user_repository, event_repository, task_repository, raffle_repository)
+    elif config.storage_backend != 'google':
+        raise ValueError(f"Unknown storage backend {config.storage_backend}")
+
+    loy = AsyncLoyverseApi(
+        config.loyverse_token,
+        users=user_repository,
+        read_only=config.loyverse_read_only,
+        timeout=config.loyverse_timeout,
+        customer_ttl=config.loyverse_customer_ttl,
+        points_window=config.loyverse_points_window,
+        points_audit_path=config.loyverse_points_audit_path,
+        requests_per_minute=config.loyverse_requests_per_minute,
+        max_retries=config.loyverse_max_retries,
+        base_url=config.loyverse_base_url,
     )
-
-    event_repository = GoogleSheetEventRepository(database, config.timezone)
-    user_repository = GoogleSheetUserRepository(database, config.timezone)
-    task_repository = GoogleSheetTaskRepository(database, config.timezone)
-    raffle_repository = GoogleSheetRaffleRepository(database, config.timezone)
-
-    loy = LoyverseApi(config.loyverse_token, users=user_repository, read_only=config.loyverse_read_only)
     ac = AccessChecker(
         masters=config.masters,
         point_masters=config.point_masters,
@@ -79,12 +135,18 @@ def main() -> None:
         checkpoints=config.visits_to_points
     )
 
+    # Without a port, the visits are only found by polling Loyverse every few minutes
+    webhook = LoyverseWebhookReceiver(config.visits_webhook_path, config.visits_webhook_secret, port=config.visits_webhook_port) if config.visits_webhook_port else None
+
+    # Without a Google sheet, there are no Google calls to report
+    metrics = {'Loyverse': loy.metrics} | ({'Google': database.metrics} if database else {})
+
     raffle = Raffle(loy, entries=raffle_repository, title="Euro 2024 Sweepstakes", ticket_price=Points(5), max_tickets=3)
 
     modules = [
         PointsModule(loy=loy, users=user_repository),
         DonateModule(loy=loy, ac=ac, users=user_repository, announcement_chats=config.announcement_chats),
-        VisitsModule(loy=loy, users=user_repository, vc=vc, timezone=config.timezone),
+        VisitsModule(loy=loy, users=user_repository, vc=vc, timezone=config.timezone, webhook=webhook, reconciliation_interval=config.visits_reconciliation_interval),
         RaffleModule(raffle=raffle, users=user_repository),
         BirthdayModule(
             loy=loy,
@@ -99,17 +161,33 @@ def main() -> None:
         TasksModule(tasks=task_repository, tasks_chats=config.tasks_chats, timezone=config.timezone),
         AnnouncementsModule(team_schedule_chats=config.team_schedule_chats, timezone=config.timezone),
         TrackingModule(users=user_repository, timezone=config.timezone),
+        StatsModule(ac=ac, metrics=metrics, log_interval=config.stats_log_interval),
     ]
 
     # The help module must be last because it catches all chat, and it picks up menu buttons from the other modules
     help_module = HelpModule(modules.copy())  # shallow copy
     modules.append(help_module)
 
-    application = ApplicationBuilder().token(config.telegram_token).build()
+    async def shutdown(application: Application) -> None:
+        # No new receipts should come in while we wrap up
+        if webhook:
+            webhook.stop()
+
+        # The queued points go first, because awarding them can still save users, e.g. when it links a customer
+        await loy.close()
+
+        # Write any queued changes before the bot exits; that can take a while, so it happens outside the event loop
+        await asyncio.to_thread(user_repository.close)
+        await asyncio.to_thread(raffle_repository.close)
+
+    application = ApplicationBuilder().token(config.telegram_token).concurrent_updates(True).post_shutdown(shutdown).build()
     for module in modules:
         module.install(application)
 
-    application.job_queue.run_repeating(callback=database.refresh_job, interval=60 * 5)  # Refresh every 5 minutes
+    if database:
+        # Unknown customers may have just been added to the community
+        database.users.subscribe(lambda _: loy.forget_unknown_customers())
+        application.job_queue.run_repeating(callback=database.refresh_job, interval=60 * 5, first=0)  # Refresh every 5 minutes
 
     # Start the Bot
     logger.info('start_polling')
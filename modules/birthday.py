@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import pytz
 from typing import Optional
@@ -17,7 +18,7 @@ from helpers.chat_target import ChatTarget
 
 from messages import birthday_congratulations
 
-from integrations.loyverse.api import LoyverseApi
+from integrations.loyverse.async_api import AsyncLoyverseApi
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +30,8 @@ Enjoy {points} Loyalty Points from T5 🎁
 """
 
 class BirthdayModule(BaseModule):
-    def __init__(self, loy: LoyverseApi, ac: AccessChecker, users: UserRepository, announcement_chats: set[ChatTarget] = None, admin_chats: set[ChatTarget] = None, points_to_award: Points = Points(5), timezone: Optional[pytz.timezone] = None):
-        self.loy: LoyverseApi = loy
+    def __init__(self, loy: AsyncLoyverseApi, ac: AccessChecker, users: UserRepository, announcement_chats: set[ChatTarget] = None, admin_chats: set[ChatTarget] = None, points_to_award: Points = Points(5), timezone: Optional[pytz.timezone] = None):
+        self.loy: AsyncLoyverseApi = loy
         self.ac: AccessChecker = ac
         self.users: UserRepository = users
         self.announcement_chats: set[ChatTarget] = (announcement_chats or set()).copy()
@@ -64,12 +65,15 @@ class BirthdayModule(BaseModule):
 
         logger.info(f"The following users have birthdays today: {users}")
 
-        self._add_points(users)
+        await self._add_points(users)
         await self._announce_birthdays(users, context)
 
-    def _add_points(self, users: list[User]) -> None:
-        for user in users:
-            self.loy.add_points(user, self.points_to_award)
+    async def _add_points(self, users: list[User]) -> None:
+        # One failed award must not keep the others from getting their points, or everyone from being congratulated
+        results = await asyncio.gather(*[self.loy.queue_points(user, self.points_to_award, 'birthday') for user in users], return_exceptions=True)
+        for user, result in zip(users, results):
+            if isinstance(result, Exception):
+                logger.error(f"Could not award the birthday points to {user.full_name}: {result}")
 
     async def _announce_birthdays(self, users: list[User], context: ContextTypes.DEFAULT_TYPE) -> None:
         if not self.announcement_chats:
@@ -15,7 +15,7 @@ from helpers.chat_target import ChatTarget
 
 from messages import donate_sarcasm
 
-from integrations.loyverse.api import LoyverseApi
+from integrations.loyverse.async_api import AsyncLoyverseApi
 from integrations.loyverse.exceptions import InsufficientFundsError, InvalidCustomerError
 
 logger = logging.getLogger(__name__)
@@ -24,8 +24,8 @@ logger = logging.getLogger(__name__)
 class DonateModule(BaseModule):
     HELP_TEXT = "To use this command you need to write it like this:\n/donate name points\nFor example:\n/donate Moni G 5"
 
-    def __init__(self, loy: LoyverseApi, ac: AccessChecker, users: UserRepository, announcement_chats: set[ChatTarget] = None):
-        self.loy: LoyverseApi = loy
+    def __init__(self, loy: AsyncLoyverseApi, ac: AccessChecker, users: UserRepository, announcement_chats: set[ChatTarget] = None):
+        self.loy: AsyncLoyverseApi = loy
         self.ac: AccessChecker = ac
         self.users: UserRepository = users
         self.announcement_chats: set[ChatTarget] = (announcement_chats or set()).copy()
@@ -80,7 +80,7 @@ class DonateModule(BaseModule):
                 await update.message.reply_html(f"There is more than one person who goes by that name. Please <a href=\"https://t.me/T5socialBot?start={passthrough}\">contact me in private</a> so I can help you find the right one.")
                 return
 
-            self._execute_donation(sender, recipient, points)
+            await self._execute_donation(sender, recipient, points)
 
             messages = DonateModule._make_donation_messages(sender, recipient, points)
 
@@ -148,7 +148,7 @@ class DonateModule(BaseModule):
             sender = self._validate_sender(update)
             recipient = self._validate_recipient_direct(args[2], sender)
 
-            self._execute_donation(sender, recipient, points)
+            await self._execute_donation(sender, recipient, points)
 
             messages = DonateModule._make_donation_messages(sender, recipient, points)
 
@@ -216,10 +216,10 @@ class DonateModule(BaseModule):
 
         return recipient
 
-    def _execute_donation(self, sender: User, recipient: User, points: Points) -> None:
+    async def _execute_donation(self, sender: User, recipient: User, points: Points) -> None:
         if not self.ac.can_donate_for_free(sender):
             try:
-                self.loy.remove_points(sender, points)
+                await self.loy.remove_points(sender, points)
             except InvalidCustomerError as error:
                 raise UserFriendlyError(f"You do not have a bar tab as a Community Champion. You should ask Rob to make one for you.") from error
             except InsufficientFundsError as error:
@@ -228,7 +228,7 @@ class DonateModule(BaseModule):
                 raise UserFriendlyError("The donation has failed - perhaps the stars were not right? You can try again later.") from error
 
         try:
-            self.loy.add_points(recipient, points)
+            await self.loy.queue_points(recipient, points, f"donation from {sender.full_name}")
         except InvalidCustomerError as error:
             raise UserFriendlyError(f"{recipient.friendly_name} does not have a bar tab as a Community Champion. You should ask Rob to make one for them.") from error
         except Exception as error:
@@ -12,13 +12,13 @@ from helpers.exceptions import UserFriendlyError
 
 from messages import points_balance_sarcasm
 
-from integrations.loyverse.api import LoyverseApi
+from integrations.loyverse.async_api import AsyncLoyverseApi
 
 logger = logging.getLogger(__name__)
 
 
 class PointsModule(BaseModule):
-    def __init__(self, loy: LoyverseApi, users: UserRepository):
+    def __init__(self, loy: AsyncLoyverseApi, users: UserRepository):
         self.loy = loy
         self.users = users
 
@@ -37,7 +37,7 @@ class PointsModule(BaseModule):
     async def _balance(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         try:
             user = self._validate_user(update)
-            balance = self.loy.get_balance(user).to_integral()
+            balance = (await self.loy.get_balance(user)).to_integral()
             sarc = points_balance_sarcasm.random
 
             if update.effective_chat.type == ChatType.PRIVATE:
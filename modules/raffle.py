@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -39,6 +40,9 @@ class RaffleModule(BaseModule):
         self.raffle = raffle
         self.users = users
 
+        # One purchase at a time for every user; there are never more of them than the size of the community
+        self._purchase_locks: dict[str, asyncio.Lock] = {}
+
     def install(self, application: Application) -> None:
         if not self.raffle.is_active:
             return
@@ -61,7 +65,7 @@ class RaffleModule(BaseModule):
         try:
             user = self._validate_user(update)
 
-            result = self._execute_buy(user)
+            result = await self._execute_buy(user)
 
             await update.message.reply_html(result + "\n\n" + HELP_PUBLIC, disable_web_page_preview=True)
         except UserFriendlyError as e:
@@ -109,7 +113,7 @@ class RaffleModule(BaseModule):
         try:
             user = self._validate_user(update)
 
-            message = self._execute_buy(user)
+            message = await self._execute_buy(user)
 
             keyboard = self._menu_keyboard('raffle/bought', user)
 
@@ -123,14 +127,16 @@ class RaffleModule(BaseModule):
             await update.callback_query.answer()
             await update.callback_query.edit_message_text(f"BeeDeeBeeBoop 🤖 Error : {e}")
 
-    def _execute_buy(self, user: User) -> str:
-        if not self.raffle.can_enter(user):
-            raise UserFriendlyError(f"You already have {self.raffle.max_tickets} entries so any more than this will get you a red card!")
+    async def _execute_buy(self, user: User) -> str:
+        # The updates are handled concurrently, so a double tap could otherwise buy a ticket over the limit
+        async with self._purchase_lock(user):
+            if not self.raffle.can_enter(user):
+                raise UserFriendlyError(f"You already have {self.raffle.max_tickets} entries so any more than this will get you a red card!")
 
-        try:
-            self.raffle.buy_ticket(user)
-        except InsufficientFundsError as error:
-            raise UserFriendlyError(f"Oh no! You don't have enough points for the {self.raffle.title}. Buy some drinks from the bar or beg a friend for a donation!") from error
+            try:
+                await self.raffle.buy_ticket(user)
+            except InsufficientFundsError as error:
+                raise UserFriendlyError(f"Oh no! You don't have enough points for the {self.raffle.title}. Buy some drinks from the bar or beg a friend for a donation!") from error
 
         entries = self.raffle.get_entries(user)
         if not entries:
@@ -142,6 +148,11 @@ class RaffleModule(BaseModule):
 
         return f"Congrats {user.main_alias or user.first_name}! You just bought a ticket for the {self.raffle.title}!{country_message}\n\nThanks for supporting and good luck!"
 
+    def _purchase_lock(self, user: User) -> asyncio.Lock:
+        if user.full_name not in self._purchase_locks:
+            self._purchase_locks[user.full_name] = asyncio.Lock()
+        return self._purchase_locks[user.full_name]
+
     async def _list_entries(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         try:
             user = self._validate_user(update)
@@ -0,0 +1,40 @@
+import html
+import logging
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ContextTypes, filters
+
+from helpers.access_checker import AccessChecker
+from helpers.metrics import Metrics
+
+from modules.base_module import BaseModule
+
+logger = logging.getLogger(__name__)
+
+
+# Reports what the integrations have been counting, e.g. how many calls we made to Google and Loyverse and how long they took
+# The numbers go to the log every once in a while, and the bot masters can ask for them at any time with /stats
+class StatsModule(BaseModule):
+    def __init__(self, ac: AccessChecker, metrics: dict[str, Metrics], log_interval: float = 60 * 60):
+        self.ac = ac
+        self.metrics = metrics
+        self.log_interval = log_interval
+
+    def install(self, application: Application) -> None:
+        application.add_handler(CommandHandler('stats', self._stats, filters.ChatType.PRIVATE))
+
+        if self.log_interval:
+            application.job_queue.run_repeating(callback=self._log_stats, interval=self.log_interval, first=self.log_interval)
+
+        logger.info("Stats module installed")
+
+    async def _stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not self.ac.is_master(update.effective_user.username):
+            return
+
+        sections = [f"<b>{html.escape(name)}</b>\n" + html.escape('\n'.join(metrics.report() or ['Nothing yet'])) for name, metrics in self.metrics.items()]
+        await update.message.reply_html('\n\n'.join(sections) or 'Nothing to report')
+
+    async def _log_stats(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        for name, metrics in self.metrics.items():
+            logger.info(f"{name} stats: {'; '.join(metrics.report()) or 'nothing yet'}")
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import pytz
 from datetime import datetime, time
@@ -101,7 +102,8 @@ class TasksModule(BaseModule):
             )
 
             task_list = self.tasks.get_tasks_between(start, end)
-            task_list[task_id] = self.tasks.toggle(task_list[task_id])
+            # Saving the task can wait on Google for a while, so it happens outside the event loop
+            task_list[task_id] = await asyncio.to_thread(self.tasks.toggle, task_list[task_id])
 
             await update.callback_query.answer()
             await update.callback_query.edit_message_text(update.effective_message.text, reply_markup=self._tasks_keyboard(task_list, list_id), parse_mode=ParseMode.HTML)
@@ -1,9 +1,11 @@
+import asyncio
 import logging
 import pytz
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from typing import Optional, Tuple
 
-from telegram import Update, InlineKeyboardButton
+from telegram import Bot, Update, InlineKeyboardButton
 from telegram.constants import ChatType
 from telegram.ext import Application, ContextTypes, CommandHandler, CallbackQueryHandler
 
@@ -15,9 +17,11 @@ from modules.base_module import BaseModule
 from helpers.points import Points
 from helpers.visit_calculator import VisitCalculator, ReachedCheckpoints
 from helpers.exceptions import UserFriendlyError
+from helpers.ttl_cache import TtlCache
 
-from integrations.loyverse.api import LoyverseApi
+from integrations.loyverse.async_api import AsyncLoyverseApi
 from integrations.loyverse.receipt import Receipt
+from integrations.loyverse.webhook_receiver import LoyverseWebhookReceiver
 
 from messages import visits_checkpoints
 
@@ -25,15 +29,24 @@ logger = logging.getLogger(__name__)
 
 
 class VisitsModule(BaseModule):
-    def __init__(self, loy: LoyverseApi, users: UserRepository, vc: VisitCalculator, timezone: pytz.timezone = None):
+    def __init__(self, loy: AsyncLoyverseApi, users: UserRepository, vc: VisitCalculator, timezone: pytz.timezone = None, max_concurrent_lookups: int = 5, webhook: LoyverseWebhookReceiver = None, reconciliation_interval: float = 60 * 60):
         self.loy = loy
         self.users = users
         self.timezone = timezone
         self.vc = vc
+        self.max_concurrent_lookups = max_concurrent_lookups
+        self.webhook = webhook
+        self.reconciliation_interval = reconciliation_interval
 
         # We start checking for visits from the first day of the current month
         self.last_check = datetime.now(self.timezone).replace(day=1, hour=0, minute=0, second=0)
 
+        # The same receipt can come from the webhook, from a webhook retry and from the poll, but it only counts once
+        self._processed_receipts: TtlCache[str, bool] = TtlCache(7 * 24 * 60 * 60, max_size=100000)
+        # The numbers from the webhook that Loyverse didn't know, so the same made-up numbers don't cost us calls again
+        self._unknown_receipts: TtlCache[str, bool] = TtlCache(60 * 60, max_size=10000)
+        self._processing_lock = asyncio.Lock()
+
     def install(self, application: Application) -> None:
         application.add_handlers([
             CommandHandler("visits", self._status),
@@ -41,7 +54,13 @@ class VisitsModule(BaseModule):
         ])
 
         application.job_queue.run_once(callback=self._update_visits, when=0)
-        application.job_queue.run_repeating(callback=self._update_visits, interval=60 * 5)
+
+        # With the webhook, the receipts come in as soon as they are made, so the poll only picks up the ones that got lost
+        if self.webhook:
+            application.job_queue.run_once(callback=self._start_webhook, when=0)
+            application.job_queue.run_repeating(callback=self._update_visits, interval=self.reconciliation_interval)
+        else:
+            application.job_queue.run_repeating(callback=self._update_visits, interval=60 * 5)
 
         logger.info(f"Visits module installed")
 
@@ -101,51 +120,130 @@ class VisitsModule(BaseModule):
         # This function may take several seconds to run, so it's important that we sample the time at the start
         right_now = datetime.now(self.timezone)
 
-        # Load fresh visits that came in since the last time we checked
-        raw_visits = self._load_visits(self.last_check)
-        updates = self.vc.add_visits(raw_visits, right_now)
-
-        # Save the resulting user data to the repository
-        self.users.save_all(list(updates.keys()))
-
-        # Send messages to users about the points they received
-        await self._send_messages(updates, right_now, context)
+        # Load fresh receipts that came in since the last time we checked
+        receipts = [receipt async for receipt in self.loy.get_receipts(self.last_check)]
+        await self._process_receipts(receipts, right_now, context.bot)
 
         # Remember when we last retrieved new information
         self.last_check = right_now
 
-    def _load_visits(self, since: datetime) -> list[Tuple[User, datetime]]:
-        # Load the receipts and convert them into visits (User + creation date)
-        receipts = self.loy.get_receipts(since)
-        raw_visits = [self._receipt_to_visit(receipt) for receipt in receipts]
+    async def _start_webhook(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        loop = asyncio.get_running_loop()
+        bot = context.bot
+
+        # The webhook calls come in on another thread, so the receipt numbers are handed over to the event loop
+        def receive(receipt_numbers: list[str]) -> None:
+            future = asyncio.run_coroutine_threadsafe(self._process_webhook(receipt_numbers, datetime.now(self.timezone), bot), loop)
+            future.add_done_callback(VisitsModule._log_failure)
+
+        self.webhook.start(receive)
+
+    async def _process_webhook(self, receipt_numbers: list[str], right_now: datetime, bot: Bot) -> None:
+        # Anyone could have called the webhook, so only the receipts that Loyverse itself knows about count
+        receipt_numbers = [number for number in dict.fromkeys(receipt_numbers) if number not in self._processed_receipts and number not in self._unknown_receipts]
+        semaphore = asyncio.Semaphore(self.max_concurrent_lookups)
+
+        async def fetch(receipt_number: str) -> Optional[Receipt]:
+            async with semaphore:
+                return await self.loy.get_receipt(receipt_number, self.timezone)
+
+        receipts = await asyncio.gather(*[fetch(receipt_number) for receipt_number in receipt_numbers])
+        unknown = [number for number, receipt in zip(receipt_numbers, receipts) if not receipt]
+        for number in unknown:
+            self._unknown_receipts.set(number, True)
+        if unknown:
+            logger.warning(f"Ignoring receipts from the Loyverse webhook that Loyverse doesn't know: {unknown}")
+
+        await self._process_receipts([receipt for receipt in receipts if receipt], right_now, bot)
+
+    async def _process_receipts(self, receipts: list[Receipt], right_now: datetime, bot: Bot) -> None:
+        async with self._processing_lock:
+            receipts = [receipt for receipt in receipts if receipt.receipt_number not in self._processed_receipts]
+            if not receipts:
+                return
+
+            raw_visits = await self._load_visits(receipts)
+            updates = self.vc.add_visits(raw_visits, right_now)
+
+            # Save the resulting user data to the repository
+            self.users.save_all(list(updates.keys()))
+
+            # Only now the receipts count as processed; if anything failed, the next poll tries them again
+            for receipt in receipts:
+                self._processed_receipts.set(receipt.receipt_number, True)
+
+            # Send messages to users about the points they received
+            await self._send_messages(updates, right_now, bot)
+
+    async def _load_visits(self, receipts: list[Receipt]) -> list[Tuple[User, datetime]]:
+        # Convert the receipts into visits (User + creation date)
+        receipts = [receipt for receipt in receipts if receipt.customer_id]
+
+        # Regulars have many receipts, so every customer is only looked up once
+        customer_ids = {receipt.customer_id for receipt in receipts}
+        users_by_customer_id = await self._resolve_customers(customer_ids)
+        logger.info(f"Resolved {len(customer_ids)} unique customers for {len(receipts)} receipts")
+
+        raw_visits = [VisitsModule._receipt_to_visit(receipt, users_by_customer_id) for receipt in receipts]
         return [visit for visit in raw_visits if visit]
 
-    def _receipt_to_visit(self, receipt: Receipt) -> Optional[Tuple[User, datetime]]:
-        if not receipt.customer_id:
-            return None
+    async def _resolve_customers(self, customer_ids: set[str]) -> dict[str, Optional[User]]:
+        # Resolve a few customers at the same time, without flooding Loyverse with calls
+        semaphore = asyncio.Semaphore(self.max_concurrent_lookups)
+
+        async def resolve(customer_id: str) -> Optional[User]:
+            async with semaphore:
+                return await self.loy.get_user_by_customer_id(customer_id)
 
-        user = self.loy.get_user_by_customer_id(receipt.customer_id)
+        customer_ids = list(customer_ids)
+        users = await asyncio.gather(*[resolve(customer_id) for customer_id in customer_ids])
+        return dict(zip(customer_ids, users))
+
+    @staticmethod
+    def _receipt_to_visit(receipt: Receipt, users_by_customer_id: dict[str, Optional[User]]) -> Optional[Tuple[User, datetime]]:
+        user = users_by_customer_id.get(receipt.customer_id)
         if not user:
             return None
 
         return user, receipt.created_at
 
-    async def _send_messages(self, updates: dict[User, ReachedCheckpoints], right_now: datetime, context: ContextTypes.DEFAULT_TYPE):
+    async def _send_messages(self, updates: dict[User, ReachedCheckpoints], right_now: datetime, bot: Bot):
         updates_with_points = {user: points for user, points in updates.items() if points and VisitsModule._can_earn_points(user)}
+
+        # Queue all the points first, so every user gets a single Loyverse update, no matter how many months they were rewarded for
+        awards = {
+            user: asyncio.gather(*[
+                self.loy.queue_points(user, sum(checkpoints.values(), start=Points(0)), f"visits in {month.strftime('%B %Y')}")
+                for month, checkpoints in month_checkpoints.items()
+            ], return_exceptions=True)
+            for user, month_checkpoints in updates_with_points.items()
+        }
+
+        # A user whose points could not be saved, or who can't be messaged, must not keep the others from hearing about theirs
         for user, month_checkpoints in updates_with_points.items():
-            for month, checkpoints in month_checkpoints.items():
-                total_points = sum(checkpoints.values(), start=Points(0))
-                a_total_of = 'a total of ' if len(checkpoints) > 1 else ''
-                self.loy.add_points(user, total_points)
-                print(f"{user.full_name} receives {a_total_of}{total_points} point{total_points.plural} for visits in {month.strftime('%B')}")
-
-                if user.telegram_id:
-                    max_checkpoint = max(checkpoints.keys())
-                    messages = visits_checkpoints.get(max_checkpoint, [])
-                    message = (messages.random + "\n\n") if messages else ''
-                    month_text = 'this month' if month.month == right_now.month else f"in {month.strftime('%B')}"
-                    announcement = f"{message}Because you visited us on {max_checkpoint} occasions {month_text}, we want to thank you for your persistence with {a_total_of}{total_points} point{total_points.plural}!"
-                    await context.bot.send_message(user.telegram_id, announcement)
+            errors = [result for result in await awards[user] if isinstance(result, Exception)]
+            if errors:
+                logger.error(f"Could not award the points for visits to {user.full_name}: {errors[0]}")
+                continue
+
+            try:
+                await self._send_user_messages(user, month_checkpoints, right_now, bot)
+            except Exception as e:
+                logger.exception(e)
+
+    async def _send_user_messages(self, user: User, month_checkpoints: ReachedCheckpoints, right_now: datetime, bot: Bot) -> None:
+        for month, checkpoints in month_checkpoints.items():
+            total_points = sum(checkpoints.values(), start=Points(0))
+            a_total_of = 'a total of ' if len(checkpoints) > 1 else ''
+            print(f"{user.full_name} receives {a_total_of}{total_points} point{total_points.plural} for visits in {month.strftime('%B')}")
+
+            if user.telegram_id:
+                max_checkpoint = max(checkpoints.keys())
+                messages = visits_checkpoints.get(max_checkpoint, [])
+                message = (messages.random + "\n\n") if messages else ''
+                month_text = 'this month' if month.month == right_now.month else f"in {month.strftime('%B')}"
+                announcement = f"{message}Because you visited us on {max_checkpoint} occasions {month_text}, we want to thank you for your persistence with {a_total_of}{total_points} point{total_points.plural}!"
+                await bot.send_message(user.telegram_id, announcement)
 
     def _validate_user(self, update: Update) -> User:
         sender_name = update.effective_user.username
@@ -158,6 +256,11 @@ class VisitsModule(BaseModule):
 
         return sender
 
+    @staticmethod
+    def _log_failure(future: Future) -> None:
+        if not future.cancelled() and future.exception():
+            logger.error(f"Could not process the receipts from the Loyverse webhook: {future.exception()}")
+
     @staticmethod
     def _can_earn_points(user: User) -> bool:
         return user.role != UserRole.STAFF
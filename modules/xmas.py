@@ -14,7 +14,7 @@ from helpers.points import Points
 
 from messages import donate_sarcasm
 
-from integrations.loyverse.api import LoyverseApi
+from integrations.loyverse.async_api import AsyncLoyverseApi
 from integrations.loyverse.exceptions import InsufficientFundsError, InvalidCustomerError
 
 logger = logging.getLogger(__name__)
@@ -24,8 +24,8 @@ class XmasModule(BaseModule):
     HELP_TEXT = "Express your appreciation for the staff this Christmas by donating some of your points. These will be distributed among our team on New Year's Eve!"
     SYNTAX_HELP_TEXT = "To use this command you need to write it like this:\n/xmas points\nFor example:\n/xmas 5"
 
-    def __init__(self, loy: LoyverseApi, ac: AccessChecker, users: UserRepository, xmas_loyverse_id: str):
-        self.loy: LoyverseApi = loy
+    def __init__(self, loy: AsyncLoyverseApi, ac: AccessChecker, users: UserRepository, xmas_loyverse_id: str):
+        self.loy: AsyncLoyverseApi = loy
         self.ac: AccessChecker = ac
         self.users: UserRepository = users
         self.recipient = User(full_name='Xmas Pot', loyverse_id=xmas_loyverse_id)
@@ -65,7 +65,7 @@ class XmasModule(BaseModule):
                 )
                 return
 
-            self._execute_donation(sender, points)
+            await self._execute_donation(sender, points)
 
             messages = XmasModule._make_donation_messages(sender, points)
 
@@ -98,7 +98,7 @@ class XmasModule(BaseModule):
             points = self._validate_points(args[2])
             sender = self._validate_sender(update)
 
-            self._execute_donation(sender, points)
+            await self._execute_donation(sender, points)
 
             messages = XmasModule._make_donation_messages(sender, points)
 
@@ -134,10 +134,10 @@ class XmasModule(BaseModule):
 
         return sender
 
-    def _execute_donation(self, sender: User, points: Points) -> None:
+    async def _execute_donation(self, sender: User, points: Points) -> None:
         if not self.ac.can_donate_for_free(sender):
             try:
-                self.loy.remove_points(sender, points)
+                await self.loy.remove_points(sender, points)
             except InvalidCustomerError as error:
                 raise UserFriendlyError(f"You do not have a bar tab as a Community Champion. You should ask the hard-working elves at the bar to make one for you.") from error
             except InsufficientFundsError as error:
@@ -146,7 +146,7 @@ class XmasModule(BaseModule):
                 raise UserFriendlyError("The donation has failed - perhaps the stars were not right? You can try again later.") from error
 
         try:
-            self.loy.add_points(self.recipient, points)
+            await self.loy.queue_points(self.recipient, points, f"xmas donation from {sender.full_name}")
         except InvalidCustomerError as error:
             raise UserFriendlyError(f"The donation has failed - it seems we can't find the Xmas Pot. We will get our elves to look for it and count every penny once again.") from error
         except Exception as error:
@@ -0,0 +1,19 @@
+import pytest
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+COMMUNITY_HEADER = ['Full Name', 'Aliases', 'Role', 'Telegram Username', 'Birthday', 'Telegram ID', 'Loyverse ID', 'Last Private Chat', 'Last Visit', 'Recent Visits']
+
+
+def community_row(full_name: str, telegram_username: str = '', recent_visits: int = 0) -> list[str]:
+    return [full_name, '', 'Champion', telegram_username, '', '', '', '', '', str(recent_visits)]
+
+
+@pytest.fixture
+def sheets() -> dict[str, list[list[str]]]:
+    # The smallest spreadsheet that all the Google sheet repositories can load
+    return {
+        'Events': [['Event', 'Date', 'Time', 'Host', 'Description'], ['Quiz Night', '2024-06-01', '19:00', 'Ann Smith', 'Bring a pen']],
+        'Community': [COMMUNITY_HEADER, community_row('Ann Smith', 'ann'), community_row('Bob Jones', 'bob')],
+        'Team Checklist': [sum([[day, '', ''] for day in WEEKDAYS], []), ['Time', 'Task', 'Done'] * 7, ['10:00', 'Open the bar', 'FALSE']],
+        'Raffle': [['Champion Name', 'Date', 'Country'], ['Ann Smith', '2024-06-01 10:00:00', 'Spain']],
+    }
@@ -0,0 +1,24 @@
+from datetime import datetime, timezone
+
+from integrations.loyverse.fake_server import FakeLoyverseServer
+
+
+def test_synthetic_data_depends_only_on_the_seed():
+    until = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    first = FakeLoyverseServer.synthetic(customers=50, months=1, receipts_per_day=40, seed=3, until=until)
+    second = FakeLoyverseServer.synthetic(customers=50, months=1, receipts_per_day=40, seed=3, until=until)
+    try:
+        assert first.customers == second.customers
+        assert first.receipts == second.receipts
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_receipt_numbers_are_unique():
+    with FakeLoyverseServer.synthetic(customers=50, months=1, receipts_per_day=40, seed=3) as server:
+        for _ in range(100):
+            server.add_receipt(None)
+        numbers = [receipt['receipt_number'] for receipt in server.receipts]
+
+    assert len(numbers) == len(set(numbers)) == 30 * 40 + 100
@@ -0,0 +1,78 @@
+import pytest
+import pytz
+from gspread.exceptions import APIError
+
+from conftest import community_row
+from integrations.google.fake_api import FakeGoogleApi
+from integrations.google.sheet_database import GoogleSheetDatabase
+from integrations.google.sheet_task_repository import GoogleSheetTaskRepository
+from integrations.google.sheet_user_repository import GoogleSheetUserRepository
+
+
+@pytest.fixture
+def api(sheets) -> FakeGoogleApi:
+    return FakeGoogleApi({'key': sheets}, requests_per_minute=6000)
+
+
+@pytest.fixture
+def database(api) -> GoogleSheetDatabase:
+    return GoogleSheetDatabase('key', api=api)
+
+
+def test_queued_user_saves_are_written_with_a_single_call(api, database):
+    users = GoogleSheetUserRepository(database, pytz.utc, write_delay=3600)
+    users.save(users.get_by_full_name('Ann Smith').copy(recent_visits=3))
+    users.save(users.get_by_full_name('Bob Jones').copy(recent_visits=5))
+    users.save(users.get_by_full_name('Ann Smith').copy(recent_visits=4))
+    assert api.client.calls['batch_update'] == 0
+
+    users.close()
+    community = api.client.spreadsheets['key'].worksheets['Community']
+    assert api.client.calls['batch_update'] == 1
+    assert community.values[1] == community_row('Ann Smith', 'ann', recent_visits=4)
+    assert community.values[2] == community_row('Bob Jones', 'bob', recent_visits=5)
+
+
+def test_refresh_skips_the_download_while_the_spreadsheet_is_not_modified(api, database):
+    users = GoogleSheetUserRepository(database, pytz.utc)
+    downloads = api.client.calls['values_batch_get']
+
+    database.refresh()
+    assert api.client.calls['values_batch_get'] == downloads
+    assert database.metrics.get('google.skipped_refreshes') == 1
+
+    # An edit made by hand moves the modified time, so the next refresh picks it up
+    community = api.client.spreadsheets['key'].worksheets['Community']
+    community.set_values(community.values + [community_row('Carl Brown', 'carl')])
+    database.refresh()
+    assert api.client.calls['values_batch_get'] == downloads + 1
+    assert users.get_by_telegram_name('carl').full_name == 'Carl Brown'
+
+
+def test_toggling_a_task_checks_its_cell(api, database):
+    tasks = GoogleSheetTaskRepository(database, pytz.utc)
+    checklist = api.client.spreadsheets['key'].worksheets['Team Checklist']
+
+    # Any value in the cell means that the task is done
+    [task] = tasks.get_all_tasks()
+    assert task.is_done
+
+    undone = tasks.toggle(task)
+    assert not undone.is_done
+    assert tasks.get_all_tasks() == [undone]
+    assert checklist.values[2][2] == ''
+
+    done = tasks.toggle(undone)
+    assert tasks.get_all_tasks() == [done]
+    assert checklist.values[2][2] == 'x'
+
+
+def test_a_failed_toggle_leaves_the_task_unchanged(api, database):
+    tasks = GoogleSheetTaskRepository(database, pytz.utc)
+    [task] = tasks.get_all_tasks()
+
+    api.client.fail_next(status_code=400)
+    with pytest.raises(APIError):
+        tasks.toggle(task)
+    assert tasks.get_all_tasks() == [task]
+    assert api.client.spreadsheets['key'].worksheets['Team Checklist'].values[2][2] == 'FALSE'
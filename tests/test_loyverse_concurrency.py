@@ -0,0 +1,66 @@
+import asyncio
+import random
+
+from helpers.points import Points
+from data.models.user import User
+from integrations.loyverse.async_api import AsyncLoyverseApi
+from integrations.loyverse.exceptions import InsufficientFundsError
+from integrations.loyverse.fake_server import FakeLoyverseServer
+
+CUSTOMERS = 5
+OPERATIONS = 300
+STARTING_POINTS = 1000
+
+
+# Many balance updates for the same few customers run at the same time, against a server that answers with a random
+# delay, so the reads and writes of the updates interleave; none of them may overwrite another
+def test_concurrent_balance_updates_are_not_lost():
+    generator = random.Random(22)
+    customers = [FakeLoyverseServer.make_customer(f'user{i}', points=STARTING_POINTS) for i in range(CUSTOMERS)]
+    users = [User(f'User {i}', telegram_username=f'user{i}', loyverse_id=customer['id']) for i, customer in enumerate(customers)]
+    operations = [(generator.choice(users), generator.choice([1, -1]) * generator.randint(1, 5)) for _ in range(OPERATIONS)]
+
+    expected = {user.loyverse_id: STARTING_POINTS for user in users}
+    for user, delta in operations:
+        expected[user.loyverse_id] += delta
+
+    with FakeLoyverseServer(customers, jitter=0.01, seed=22) as server:
+        async def run() -> None:
+            api = AsyncLoyverseApi('token', users=None, base_url=server.url, pool_size=20, requests_per_minute=100000)
+            try:
+                await asyncio.gather(*[update(api, user, delta) for user, delta in operations])
+            finally:
+                await api.close()
+
+        asyncio.run(run())
+
+        balances = {customer_id: Points(customer['total_points']) for customer_id, customer in server.customers.items()}
+
+    assert balances == {customer_id: Points(points) for customer_id, points in expected.items()}
+
+
+def test_concurrent_removals_never_overdraw():
+    customer = FakeLoyverseServer.make_customer('user0', points=10)
+    user = User('User 0', telegram_username='user0', loyverse_id=customer['id'])
+
+    with FakeLoyverseServer([customer], jitter=0.01, seed=22) as server:
+        async def run() -> list:
+            api = AsyncLoyverseApi('token', users=None, base_url=server.url, pool_size=20, requests_per_minute=100000)
+            try:
+                return await asyncio.gather(*[api.remove_points(user, Points(3)) for _ in range(10)], return_exceptions=True)
+            finally:
+                await api.close()
+
+        results = asyncio.run(run())
+        balance = Points(server.customers[customer['id']]['total_points'])
+
+    # Only three tickets of 3 points fit into 10 points
+    assert sum(1 for result in results if isinstance(result, InsufficientFundsError)) == 7
+    assert balance == Points(1)
+
+
+async def update(api: AsyncLoyverseApi, user: User, delta: int) -> None:
+    if delta > 0:
+        await api.add_points(user, Points(delta))
+    else:
+        await api.remove_points(user, Points(-delta))
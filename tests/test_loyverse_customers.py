@@ -0,0 +1,77 @@
+import asyncio
+
+from data.models.user import User
+from helpers.points import Points
+from integrations.loyverse.async_api import AsyncLoyverseApi
+from integrations.loyverse.customer_directory import CustomerDirectory
+from integrations.loyverse.exceptions import InvalidCustomerError
+from integrations.loyverse.fake_server import FakeLoyverseServer
+
+
+class Users:
+    def __init__(self, users: list[User]):
+        self.users = {user.telegram_username: user for user in users}
+
+    def get_by_telegram_name(self, telegram_name: str):
+        return self.users.get(telegram_name)
+
+    def get_by_loyverse_id(self, loyverse_id: str):
+        return next((user for user in self.users.values() if user.loyverse_id == loyverse_id), None)
+
+    def save(self, user: User) -> None:
+        self.users[user.telegram_username] = user
+
+
+# A customer who is not linked yet is looked up in the customer list; if Loyverse fails while we download the list,
+# that must not be remembered as the customer not existing
+def test_a_failed_sync_does_not_hide_a_customer():
+    customer = FakeLoyverseServer.make_customer('ann', points=7)
+    user = User('Ann', telegram_username='ann')
+
+    with FakeLoyverseServer([customer]) as server:
+        async def run() -> list:
+            api = AsyncLoyverseApi('token', users=Users([user]), base_url=server.url, max_retries=1, requests_per_minute=100000)
+            try:
+                server.fail_next(2)
+                first = await asyncio.gather(api.get_balance(user), return_exceptions=True)
+                return first + [await api.get_balance(user)]
+            finally:
+                await api.close()
+
+        first, second = asyncio.run(run())
+
+    assert isinstance(first, InvalidCustomerError)
+    assert second == Points(7)
+
+
+def test_a_failed_sync_does_not_move_the_watermark():
+    directory = CustomerDirectory()
+    directory.update([FakeLoyverseServer.make_customer('ann') | {'updated_at': '2024-01-01T00:00:00.000Z'}])
+    directory.finish_sync()
+
+    # The second sync stops after its first page, so the customers on the other pages must be asked for again
+    directory.update([FakeLoyverseServer.make_customer('bob') | {'updated_at': '2024-03-01T00:00:00.000Z'}])
+    assert directory.sync_params() == {'updated_at_min': '2024-01-01T00:00:00.000Z'}
+
+    directory.finish_sync()
+    assert directory.sync_params() == {'updated_at_min': '2024-03-01T00:00:00.000Z'}
+
+
+def test_the_connections_are_reused():
+    customer = FakeLoyverseServer.make_customer('ann', points=7)
+    user = User('Ann', telegram_username='ann', loyverse_id=customer['id'])
+
+    with FakeLoyverseServer([customer]) as server:
+        async def run() -> AsyncLoyverseApi:
+            api = AsyncLoyverseApi('token', users=Users([user]), base_url=server.url, customer_ttl=0, requests_per_minute=100000)
+            try:
+                for _ in range(5):
+                    await api.get_balance(user)
+            finally:
+                await api.close()
+            return api
+
+        api = asyncio.run(run())
+
+    assert api.metrics.get('loyverse.get_customer.new_connections') == 1
+    assert api.metrics.get('loyverse.get_customer.reused_connections') == 4
@@ -0,0 +1,66 @@
+import asyncio
+
+import httpx
+import pytest
+
+from integrations.loyverse.async_api import AsyncLoyverseApi
+from integrations.loyverse.fake_server import FakeLoyverseServer
+from integrations.loyverse.webhook_receiver import LoyverseWebhookReceiver
+
+
+SECRET = 'a-long-enough-secret'
+
+
+def test_webhook_only_hands_over_the_receipt_numbers():
+    received = []
+    receiver = LoyverseWebhookReceiver('/loyverse/receipts', SECRET, host='127.0.0.1', port=0)
+    receiver.start(received.extend)
+    try:
+        url = f'http://127.0.0.1:{receiver.port}/loyverse/receipts/{SECRET}'
+        made_up = FakeLoyverseServer.make_receipt('someone', 1)
+        assert httpx.post(url, json={'receipts': [made_up]}).status_code == 200
+        assert httpx.post(url, json={'receipts': [{'total_money': 1000}]}).status_code == 400
+        assert httpx.post(f'http://127.0.0.1:{receiver.port}/loyverse/receipts', json={'receipts': [made_up]}).status_code == 404
+    finally:
+        receiver.stop()
+
+    assert received == ['1-1']
+
+
+def test_webhook_turns_away_large_calls():
+    received = []
+    receiver = LoyverseWebhookReceiver('/loyverse/receipts', SECRET, host='127.0.0.1', port=0, max_body_size=10000, max_receipts=3)
+    receiver.start(received.extend)
+    try:
+        url = f'http://127.0.0.1:{receiver.port}/loyverse/receipts/{SECRET}'
+        assert httpx.post(url, json={'receipts': [{'receipt_number': f'1-{i}'} for i in range(4)]}).status_code == 413
+        assert httpx.post(url, content=b' ' * 10001).status_code == 413
+    finally:
+        receiver.stop()
+
+    assert received == []
+
+
+def test_webhook_needs_a_secret():
+    for secret in [None, '', 'short', 'a-long-enough/secret']:
+        with pytest.raises(ValueError):
+            LoyverseWebhookReceiver('/loyverse/receipts', secret, host='127.0.0.1', port=0)
+
+
+def test_only_receipts_that_loyverse_knows_are_loaded():
+    with FakeLoyverseServer() as server:
+        receipt = server.add_receipt(None)
+
+        async def run() -> list:
+            api = AsyncLoyverseApi('token', users=None, base_url=server.url)
+            try:
+                return [await api.get_receipt(number) for number in [receipt['receipt_number'], '1-999', '../customers']]
+            finally:
+                await api.close()
+
+        known, unknown, elsewhere = asyncio.run(run())
+
+    assert known.receipt_number == receipt['receipt_number']
+    assert unknown is None
+    assert elsewhere is None
+    assert server.calls['get_customers'] == 0
@@ -0,0 +1,59 @@
+import json
+
+import pytz
+
+from conftest import community_row
+from integrations.google.fake_api import FakeGoogleApi
+from integrations.google.sheet_database import GoogleSheetDatabase
+from integrations.google.sheet_event_repository import GoogleSheetEventRepository
+from integrations.google.sheet_raffle_repository import GoogleSheetRaffleRepository
+from integrations.google.sheet_task_repository import GoogleSheetTaskRepository
+from integrations.google.sheet_user_repository import GoogleSheetUserRepository
+from integrations.sqlite.database import SqliteDatabase
+from integrations.sqlite.event_repository import SqliteEventRepository
+from integrations.sqlite.raffle_repository import SqliteRaffleRepository
+from integrations.sqlite.sheet_sync import GoogleSheetSync
+from integrations.sqlite.task_repository import SqliteTaskRepository
+from integrations.sqlite.user_repository import SqliteUserRepository
+
+
+def start(api: FakeGoogleApi, sqlite_database: SqliteDatabase, snapshot_path: str = None, write_delay: float = 0):
+    database = GoogleSheetDatabase('key', api=api, snapshot_path=snapshot_path)
+    users = SqliteUserRepository(sqlite_database, pytz.utc, mirror=GoogleSheetUserRepository(database, pytz.utc, write_delay=write_delay))
+    events = SqliteEventRepository(sqlite_database, pytz.utc, mirror=GoogleSheetEventRepository(database, pytz.utc))
+    tasks = SqliteTaskRepository(sqlite_database, pytz.utc, mirror=GoogleSheetTaskRepository(database, pytz.utc))
+    raffle = SqliteRaffleRepository(sqlite_database, pytz.utc, mirror=GoogleSheetRaffleRepository(database, pytz.utc, write_delay=0))
+    GoogleSheetSync(database, users, events, tasks, raffle)
+    return database, users
+
+
+# The bot stopped before its last changes reached the sheet, and it starts again from an older snapshot of the sheet
+def test_an_old_snapshot_does_not_revert_or_remove_local_changes(sheets, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot.json')
+    with open(snapshot_path, 'w', encoding='utf-8') as file:
+        json.dump({'modified_time': 'long ago', 'values': sheets}, file)
+
+    api = FakeGoogleApi({'key': sheets}, requests_per_minute=6000)
+    community = api.client.spreadsheets['key'].worksheets['Community']
+    sqlite_database = SqliteDatabase(str(tmp_path / 'bot.sqlite3'))
+
+    # The first run imports the sheet, and then Ann visits a few times, but it stops before her visits are written
+    database, users = start(api, sqlite_database, write_delay=3600)
+    users.save(users.get_by_full_name('Ann Smith').copy(recent_visits=9))
+    community.set_values(community.values + [community_row('Carl Brown', 'carl')])
+    database.refresh()
+
+    # Meanwhile, someone removed Bob and Carl from the sheet
+    community.set_values([row for row in community.values if row[0] not in ('Bob Jones', 'Carl Brown')])
+
+    database, users = start(api, sqlite_database, snapshot_path)
+    assert users.get_by_full_name('Ann Smith').recent_visits == 9
+    assert users.get_by_full_name('Carl Brown')
+
+    # Only the live sheet can tell who was removed
+    database.refresh()
+    users.close()
+    assert users.get_by_full_name('Bob Jones') is None
+    assert users.get_by_full_name('Carl Brown') is None
+    assert users.get_by_full_name('Ann Smith').recent_visits == 9
+    assert community.values[1][9] == '9'